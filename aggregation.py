@@ -0,0 +1,143 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Integer, and_, cast, func, select
+
+from database import DeviceReading, ROLLUP_MODELS, to_utc, utc_bound
+from retention import RETENTION_TABLES
+
+# Aggregated fields: output prefix -> readings column
+AGGREGATE_FIELDS = {
+    "dust": DeviceReading.dust_concentration,
+    "temp": DeviceReading.pcb_temp,
+    "current": DeviceReading.current_loop,
+}
+
+
+def epoch_seconds(value):
+    return int(to_utc(value).replace(tzinfo=timezone.utc).timestamp())
+
+def bucket_width(start, end, points):
+    """Bucket size in whole seconds so [start, end) fits in about `points` buckets."""
+    return max(1, math.ceil((to_utc(end) - to_utc(start)).total_seconds() / points))
+
+def bucket_expression(dialect_name, column, start_epoch, width):
+    """Index of the fixed-width bucket a timestamp falls in, computed in SQL."""
+    if dialect_name == "sqlite":
+        return (cast(func.strftime("%s", column), Integer) - start_epoch) // width
+    return cast(func.floor((func.extract("epoch", column) - start_epoch) / width), Integer)
+
+
+def aggregate_readings(db, network_address, start, end, width):
+    """Min/max/mean/last of dust, temperature and current loop per bucket.
+
+    Grouping runs in the database over the (network_address, timestamp)
+    index, only one row per bucket comes back to Python. "last" is the value
+    of the newest reading in the bucket.
+    """
+    start_epoch = epoch_seconds(start)
+    bucket = bucket_expression(db.get_bind().dialect.name, DeviceReading.timestamp, start_epoch, width).label("bucket")
+    aggregates = [bucket, func.count().label("count"), func.max(DeviceReading.id).label("last_id")]
+    for name, column in AGGREGATE_FIELDS.items():
+        aggregates += [
+            func.min(column).label(f"{name}_min"),
+            func.max(column).label(f"{name}_max"),
+            func.avg(column).label(f"{name}_mean"),
+        ]
+    grouped = (
+        select(*aggregates)
+        .where(DeviceReading.network_address == network_address,
+               DeviceReading.timestamp >= utc_bound(start),
+               DeviceReading.timestamp < utc_bound(end))
+        .group_by(bucket)
+        .subquery()
+    )
+    last_values = [column.label(f"{name}_last") for name, column in AGGREGATE_FIELDS.items()]
+    query = (
+        select(grouped, *last_values)
+        .join(DeviceReading, DeviceReading.id == grouped.c.last_id)
+        .order_by(grouped.c.bucket)
+    )
+
+    bucket_start = to_utc(start)
+    points = []
+    for row in db.execute(query).mappings():
+        point = {"timestamp": (bucket_start + timedelta(seconds=row["bucket"] * width)).isoformat(), "count": row["count"]}
+        for name in AGGREGATE_FIELDS:
+            for stat in ("min", "max", "mean", "last"):
+                point[f"{name}_{stat}"] = row[f"{name}_{stat}"]
+        points.append(point)
+    return points
+
+
+def pick_rollup(width, start=None, limits=None, now=None):
+    """Rollup table to serve buckets of width seconds, None for raw readings.
+
+    The coarsest rollup whose bucket divides width exactly, else the coarsest
+    that fits in it (aggregate_rollups then rounds width down to it). Given
+    the retention limits ({"raw_days": ..} as in RetentionPolicy.limits), a
+    table already pruned past start gives way to the next coarser one that
+    still reaches back that far, or else the one that keeps the most.
+    """
+    candidates = [model for model in ROLLUP_MODELS if model.bucket_seconds <= width]
+    exact = [model for model in candidates if width % model.bucket_seconds == 0]
+    choice = (exact or candidates or [None])[-1]
+    if start is None or not limits:
+        return choice
+    now = to_utc(now or datetime.now(timezone.utc))
+    days = {model: limits.get(key) for key, model in RETENTION_TABLES}
+    tiers = [DeviceReading, *ROLLUP_MODELS]
+    tiers = tiers[tiers.index(choice or DeviceReading):]
+    for model in tiers:
+        if days[model] is None or to_utc(start) >= now - timedelta(days=days[model]):
+            break
+    else:
+        model = max(tiers, key=lambda model: days[model])
+    return None if model is DeviceReading else model
+
+def aggregate_rollups(db, model, network_address, start, end, width):
+    """Same output as aggregate_readings, read from a rollup table.
+
+    width is rounded down to a whole number of rollup buckets, so there are
+    never fewer points than asked for, and start aligned to a bucket
+    boundary. Returns (width, points).
+    """
+    step = model.bucket_seconds
+    width = max(1, width // step) * step
+    start_epoch = epoch_seconds(start) // step * step
+    aligned_start = datetime.fromtimestamp(start_epoch, timezone.utc).replace(tzinfo=None)
+
+    bucket = bucket_expression(db.get_bind().dialect.name, model.bucket_start, start_epoch, width).label("bucket")
+    aggregates = [bucket, func.sum(model.count).label("count"), func.max(model.bucket_start).label("last_bucket")]
+    for name in AGGREGATE_FIELDS:
+        aggregates += [
+            func.min(getattr(model, f"{name}_min")).label(f"{name}_min"),
+            func.max(getattr(model, f"{name}_max")).label(f"{name}_max"),
+            func.sum(getattr(model, f"{name}_sum")).label(f"{name}_sum"),
+        ]
+    grouped = (
+        select(*aggregates)
+        .where(model.network_address == network_address,
+               model.bucket_start >= aligned_start,
+               model.bucket_start < to_utc(end))
+        .group_by(bucket)
+        .subquery()
+    )
+    last_values = [getattr(model, f"{name}_last").label(f"{name}_last") for name in AGGREGATE_FIELDS]
+    query = (
+        select(grouped, *last_values)
+        .join(model, and_(model.network_address == network_address, model.bucket_start == grouped.c.last_bucket))
+        .order_by(grouped.c.bucket)
+    )
+
+    points = []
+    for row in db.execute(query).mappings():
+        point = {"timestamp": (aligned_start + timedelta(seconds=row["bucket"] * width)).isoformat(), "count": row["count"]}
+        for name in AGGREGATE_FIELDS:
+            total = row[f"{name}_sum"]
+            point[f"{name}_min"] = row[f"{name}_min"]
+            point[f"{name}_max"] = row[f"{name}_max"]
+            point[f"{name}_mean"] = total / row["count"] if total is not None and row["count"] else None
+            point[f"{name}_last"] = row[f"{name}_last"]
+        points.append(point)
+    return width, points
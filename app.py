@@ -1,10 +1,13 @@
 #General
-import os, sys, logging #threading, webview
+import os, sys, logging, math #threading, webview
+from typing import List, Optional
+from datetime import datetime, timedelta, timezone
 
 #API Specific
-from fastapi import (FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends)
+from fastapi import (FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, Request, Query)
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager #This was used for lifespan management. Need to uncomment if needed again
@@ -12,52 +15,88 @@ import asyncio
 import uvicorn
 
 #Database imports
-from database import DeviceReading, get_db, Base, get_db_path , engine
+from database import DeviceReading, get_db, init_db, reading_row, query_readings
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 
 #Internal
-from device_communicator import (send_and_receive, 
+from device_communicator import (transact_async,
                                  decode_response, 
-                                 load_config, 
-                                 get_serial_connection, 
-                                 serial_connection,
-                                 device_status)
-
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+                                 load_config, resolve_port_async, 
+                                 get_serial_connection_async,
+                                 close_serial_port as close_port,
+                                 search_serial_ports,
+                                 serial_ports,
+                                 device_status,
+                                 NotConnectedError,
+                                 UnknownPortError)
+from protocol import encode_command, encode_value_command, decode_frame
+from reading_queue import ReadingWriteQueue
+from aggregation import aggregate_readings, aggregate_rollups, bucket_width, pick_rollup
+import export
+from rollups import ingest_readings
+import sensor_poller
+import ws_codec
+import live_feed
+import device_cache
+from poll_scheduler import PollScheduler
+import retention
+import metrics
+from link_supervisor import LinkSupervisor, stream_states
+
+# Per-request details are logged at DEBUG; LOG_LEVEL=DEBUG (or config.json
+# logging.level) turns them on, the default only shows warnings and errors
+LOG_LEVEL = os.environ.get("LOG_LEVEL") or load_config().get("logging", {}).get("level", "WARNING")
+logging.basicConfig(level=LOG_LEVEL.upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 
 #Pydantic class models, this needs unification. Some redundency in the current implementation
 class SensorDataModel(BaseModel):
     period_in_seconds: float = Field(..., ge=2, description="Period in seconds for data reading")
     network_address: int = Field(..., description="Network address of the device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
 
 class NetworkAddressModel(BaseModel):
     address: int = Field(..., ge=0, le=65535, description="Network address to set for the device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
 
 class SmoothingTimeModel(BaseModel):
     smoothtime_in_seconds: int = Field(..., ge=1, description="Smoothing time in seconds")
     network_address: int = Field(..., description="Network address of the device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
 
 class RangeModel(BaseModel):
     max_range_value: int = Field(..., ge=1, description="Maximum Range value")
     network_address: int = Field(..., description="Network address of the device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
 
 class AlarmModel(BaseModel):
     threshold_value: float = Field(..., description="Threshold value for the alarm")
     network_address: int = Field(..., description="Network address of the device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
 
 class CalibrationAModel(BaseModel):
     calibration_value: float = Field(..., description="Calibration value A")
     network_address: int = Field(..., description="Network address of the device")
     calibration_type: str = Field(..., description="Type of calibration: A or B")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
     
 class CorrectValueModel(BaseModel):
     correction_value: int = Field(..., description="Correction value for calibration")
     network_address: int = Field(..., description="Network address of the device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
 
 class deviceCalibrationModel(BaseModel):
     calibration_type: str = Field(..., description="Calibration type")
     network_address: int = Field(..., description="Network address of the device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
+
+class RosterEntryModel(BaseModel):
+    network_address: int = Field(..., ge=0, le=65535, description="Network address of the device")
+    period_in_seconds: float = Field(..., gt=0, description="Poll period for this device")
+    port: Optional[str] = Field(None, description="Serial port of the device, optional when only one adapter is present")
+
+class SchedulerModel(BaseModel):
+    roster: Optional[List[RosterEntryModel]] = Field(None, description="Devices to poll, defaults to the roster in config.json")
     
 # BASE = os.path.dirname(__file__)
 # This logic finds the 'base path' whether running as a script or a compiled .exe
@@ -72,6 +111,37 @@ logging.debug(BASE)
 
 FRONTEND_DIR = os.path.join(BASE, "frontend")
 
+# Write-behind queue for sensor readings, see reading_queue.py
+ingest_cfg = load_config().get("ingest", {})
+reading_queue = ReadingWriteQueue(
+    maxsize=ingest_cfg.get("queue_size", 10000),
+    batch_size=ingest_cfg.get("batch_size", 500),
+    flush_interval=ingest_cfg.get("flush_interval_seconds", 1.0),
+    overflow=ingest_cfg.get("overflow", "drop_oldest"),
+)
+
+# Live feed (SSE) listeners are told about every flushed batch
+reading_queue.flush_hooks.append(live_feed.broker.publish)
+
+# Latest value / recent readings per device and the last system info per port,
+# served from memory, see device_cache.py
+cache_cfg = load_config().get("cache", {})
+reading_cache = device_cache.ReadingCache(cache_cfg.get("recent_size", device_cache.DEFAULT_RECENT_SIZE))
+system_info_cache = device_cache.SystemInfoCache(cache_cfg.get("system_info_max_age_seconds"))
+reading_queue.flush_hooks.append(reading_cache.update)
+
+# Reconnects broken serial links in the background, see link_supervisor.py
+reconnect_cfg = load_config().get("serial", {}).get("reconnect", {})
+link_supervisor = LinkSupervisor(
+    interval=reconnect_cfg.get("interval_seconds", 1.0),
+    backoff_base=reconnect_cfg.get("backoff_base_seconds", 1.0),
+    backoff_max=reconnect_cfg.get("backoff_max_seconds", 30.0),
+)
+
+# Raw readings age out into the rollup tables, see retention.py
+retention_cfg = load_config().get("retention", {})
+retention_policy = retention.from_config(retention_cfg)
+
 #Used this to create the connection at startup, but now moving to button based connection
 # @asynccontextmanager
 # async def lifespan(app: FastAPI):
@@ -91,14 +161,29 @@ async def lifespan(app: FastAPI):
     #     DATABASE_URL = f"sqlite:///{normalized_path}"
     # print("DATABASE_URL", DATABASE_URL)        
     # engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-    Base.metadata.create_all(bind=engine)
+    await run_in_threadpool(init_db)
+    await run_in_threadpool(reading_cache.warm)
+    await reading_queue.start()
+    if reconnect_cfg.get("enabled", True):
+        link_supervisor.start()
+    if retention_cfg.get("enabled"):
+        retention_policy.start()
+    if load_config().get("scheduler", {}).get("autostart"):
+        start_scheduler(load_config()["scheduler"].get("roster", []))
     yield
     # Shutdown: Clean up if necessary
-    print("Shutting down...")
+    logging.info("Shutting down...")
+    sensor_poller.stop_all()
+    await link_supervisor.stop()
+    if scheduler:
+        await scheduler.stop()
+    await retention_policy.stop()
+    await reading_queue.stop()
 
 # app = FastAPI()
 
 app = FastAPI(lifespan= lifespan)
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 from fastapi import Response
 
@@ -115,25 +200,59 @@ async def decode_info(data: RawHexModel):
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/api/store-reading")
-async def store_reading(data: RawHexModel, db: Session = Depends(get_db)):
-    # Decodes and saves to Supabase
+async def store_reading(data: RawHexModel):
+    # Decodes and queues the reading, the write-behind queue saves it to the DB
     try:
         parsed_info = decode_response(data.raw_hex)
         if parsed_info:
-            new_reading = DeviceReading(
-                network_address = parsed_info.get("network_address"),
-                dust_concentration = parsed_info.get("dust_concentration"),
-                pcb_temp = parsed_info.get("pcb_temp"),
-                current_loop = parsed_info.get("current_loop"),
-                laser_diode_signal = parsed_info.get("ld"),
-                photo_diode_signal = parsed_info.get("pd")
-            )
-            db.add(new_reading)
-            db.commit()
+            if "network_address" in parsed_info:
+                await reading_queue.put(reading_row(parsed_info))
             return {"status": "success", "parsed": parsed_info}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch version of store-reading. Accepts {"raw_hex_list": [...]}, a bare JSON list,
+# or a newline-delimited body with one hex packet per line. All valid C9 readings
+# are written with one bulk insert and a single commit.
+@app.post("/api/store-readings")
+async def store_readings(request: Request, db: Session = Depends(get_db)):
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Malformed JSON body")
+        packets = body.get("raw_hex_list", []) if isinstance(body, dict) else body
+    else:
+        packets = (await request.body()).decode("utf-8", errors="replace").splitlines()
+    if not isinstance(packets, list):
+        raise HTTPException(status_code=400, detail="Expected a list of raw hex packets")
+
+    results = []
+    rows = []
+    for index, raw_hex in enumerate(packets):
+        raw_hex = str(raw_hex).strip()
+        if not raw_hex:
+            continue
+        try:
+            parsed_info = decode_response(raw_hex)
+        except Exception as e:
+            parsed_info = {"error": str(e)}
+        if "error" in parsed_info:
+            results.append({"index": index, "status": "error", "error": parsed_info["error"]})
+        elif "network_address" not in parsed_info:
+            results.append({"index": index, "status": "error", "error": "not a sensor reading"})
+        else:
+            rows.append(reading_row(parsed_info))
+            results.append({"index": index, "status": "success", "parsed": parsed_info})
+
+    try:
+        ids = await run_in_threadpool(ingest_readings, db, rows)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    live_feed.broker.publish(rows, ids)
+    reading_cache.update(rows, ids)
+    return {"status": "success", "stored": len(ids), "results": results}
 
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon():
@@ -160,81 +279,185 @@ async def index():
 #     return FileResponse('frontend/admin.html')
 
 def run_fastapi():
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    # permessage-deflate is negotiated per connection, browsers offer it by default
+    ws_cfg = load_config().get("websocket", {})
+    uvicorn.run(app, host="127.0.0.1", port=8000, ws_per_message_deflate=ws_cfg.get("per_message_deflate", True))
 
 connection = None
 
 # Connect Device
 @app.post("/api/connect-device" )
-async def connect_device():
+async def connect_device(port: Optional[str] = None):
     global connection 
-    connection = get_serial_connection()
+    connection = await get_serial_connection_async(port)
     if connection:
-        print("Connected.....")
+        logging.info("Connected to %s", device_status["port"])
         return {"status": "Connected", "port": device_status["port"]}
     else:
-        print("Not connected....")
+        logging.info("Not connected: %s", device_status["error"])
         return {"status": "NotConnected", "error": device_status["error"]}
 
 @app.post("/api/close-serial-port")
-async def close_serial_port():
-    close_serial_port(connection)
+async def close_serial_port(port: Optional[str] = None):
+    return close_port(port)
+
+# List enumerated adapters and the state of every port opened so far
+@app.get("/api/serial-ports")
+async def list_serial_ports():
+    return {
+        "available": await asyncio.to_thread(search_serial_ports),
+        "ports": [{**serial_port.status, "timing": serial_port.timing.snapshot()} for serial_port in serial_ports.values()],
+    }
+
+# Link state of every port and the supervisor's reconnect counters
+@app.get("/api/serial-ports/status")
+async def serial_ports_status():
+    return link_supervisor.snapshot()
+
+# SSE feed of connection state changes (event: link), current state first
+@app.get("/api/serial-ports/stream")
+async def stream_serial_ports(request: Request):
+    return StreamingResponse(
+        stream_states(link_supervisor, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # Read Sensor Data
 @app.post("/api/read-data")
-async def read_data(data: SensorDataModel, db: Session = Depends(get_db)):
+async def read_data(data: SensorDataModel):
     # print('data.period_in_seconds --> ', data.period_in_seconds)
     data_frequency = int(data.period_in_seconds * 10)
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
-
-    # print('data_frequency (int) --> ', data_frequency)
-    # print('hex data_frequency --> ', hex(data_frequency))
+    cmd = encode_command(data.network_address, 0xC9, data_frequency, 0x00)
 
-
-    cmd_list = [0xFA, network_address_high, network_address_low, 0xC9, data_frequency, 0x00]
-    # print("Checksum", sum(cmd_list) % 0x100)
-    checksum = (sum(cmd_list) % 0x100)
-    # print("checksum--------->", checksum)
-    cmd_list.append(checksum)
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    print('*****************calling send_and_receive with cmd:', cmd)
+    logging.debug("read-data command %s", cmd.hex(' '))
     try:
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        #Code to Store the Parse Json to DB
-        if result_data.get("parsed"):
-            parsed_info = result_data["parsed"]
-            new_reading = DeviceReading(
-                network_address = parsed_info.get("network_address"),
-                dust_concentration = parsed_info.get("dust_concentration"),
-                pcb_temp = parsed_info.get("dust_concentration"),
-                current_loop = parsed_info.get("dust_concentration"),
-                laser_diode_signal = parsed_info.get("ld"),
-                photo_diode_signal = parsed_info.get("pd")
-            )
-
-            db.add(new_reading)
-            db.commit()
-            db.close()
+        resp = await transact_async(cmd, port=data.port)
+        parsed = decode_frame(resp)
+        result_data = {"raw": resp.hex(), "parsed": parsed}
+        logging.debug("read-data result %s", result_data)
+        #Queue the parsed reading for the DB writer
+        if "network_address" in (parsed or {}):
+            await reading_queue.put(reading_row(parsed))
 
         return result_data 
+    except UnknownPortError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotConnectedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+# Multi-drop polling of a device roster on the shared bus, see poll_scheduler.py
+scheduler = None
+
+async def persist_reading(parsed):
+    await reading_queue.put(reading_row(parsed))
+
+def start_scheduler(roster):
+    global scheduler
+    scheduler = PollScheduler(roster, on_reading=persist_reading)
+    scheduler.start()
+    return scheduler
+
+@app.post("/api/scheduler/start")
+async def scheduler_start(data: SchedulerModel):
+    if scheduler:
+        await scheduler.stop()
+    if data.roster is not None:
+        roster = [{"network_address": e.network_address, "period_in_seconds": e.period_in_seconds, "port": e.port} for e in data.roster]
+    else:
+        roster = load_config().get("scheduler", {}).get("roster", [])
+    if not roster:
+        raise HTTPException(status_code=400, detail="Roster is empty")
+    return start_scheduler(roster).status()
+
+@app.post("/api/scheduler/stop")
+async def scheduler_stop():
+    if scheduler:
+        await scheduler.stop()
+        return scheduler.status()
+    return {"running": False}
+
+@app.get("/api/scheduler/status")
+async def scheduler_status():
+    if scheduler:
+        return scheduler.status()
+    return {"running": False}
+
+@app.get("/api/cache-stats")
+async def cache_stats():
+    return {
+        "devices": len(reading_cache.latest),
+        "recent_size": reading_cache.size,
+        "system_info": {**system_info_cache.stats, "entries": len(system_info_cache.entries)},
+    }
+
+@app.get("/api/live-feed-stats")
+async def live_feed_stats():
+    return live_feed.broker.snapshot()
+
+@app.get("/api/ws-clients")
+async def ws_clients():
+    return sensor_poller.snapshot()
+
+@app.get("/api/ingest-stats")
+async def ingest_stats():
+    return reading_queue.snapshot()
+
+# Gauges read from the live objects when /metrics is scraped
+@metrics.collector
+def subscriber_metrics():
+    return [
+        ("dust_websocket_subscribers", "gauge", "Continuous /ws/sensor clients per polled device",
+         [({"port": port or "", "network_address": address}, len(poller.subscribers))
+          for (port, address), poller in list(sensor_poller.pollers.items())]),
+        ("dust_sse_listeners", "gauge", "Open /api/readings/stream connections",
+         [({}, live_feed.broker.snapshot()["listeners"])]),
+        ("dust_serial_link_up", "gauge", "1 while the serial port is connected",
+         [({"port": serial_port.port}, int(serial_port.connection is not None))
+          for serial_port in list(serial_ports.values())]),
+        ("dust_ingest_queue_depth", "gauge", "Readings waiting for the write-behind queue",
+         [({}, reading_queue.queue.qsize() if reading_queue.queue is not None else 0)]),
+    ]
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/retention-stats")
+async def retention_stats():
+    return retention_policy.snapshot()
+
+@app.post("/api/retention/run")
+async def retention_run():
+    try:
+        return await asyncio.to_thread(retention_policy.run)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Retention run failed: {str(e)}")
+
+# Newest readings, oldest first for the chart. next_cursor pages further back.
 @app.get("/api/get-reading-history")
-async def get_reading_history(db: Session = Depends(get_db)):
-    readings = db.query(DeviceReading)\
-        .order_by(desc(DeviceReading.timestamp))\
-        .limit(50)\
-        .all()
+def get_reading_history(network_address: Optional[int] = None,
+                        limit: int = Query(50, ge=1, le=10000),
+                        cursor: Optional[str] = None,
+                        db: Session = Depends(get_db)):
+    next_cursor = None
+    if network_address is not None:
+        try:
+            readings, next_cursor = query_readings(db, network_address, limit=limit, cursor=cursor, descending=True)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    else:
+        readings = db.query(DeviceReading)\
+            .order_by(desc(DeviceReading.timestamp))\
+            .limit(limit)\
+            .all()
     
     readings.reverse()
 
     return {
+        "next_cursor": next_cursor,
         "history": [
             {
                 "timestamp": r.timestamp.isoformat() ,#r.timestamp.strftime("%H:%M:%S"), # Format for chart labels
@@ -246,11 +469,147 @@ async def get_reading_history(db: Session = Depends(get_db)):
     }
 
 
+# Current value and recent history straight from memory, no database or bus access
+@app.get("/api/readings/latest")
+async def get_latest_readings(network_address: Optional[int] = None):
+    if network_address is None:
+        return {"readings": reading_cache.get_latest()}
+    latest = reading_cache.get_latest(network_address)
+    if latest is None:
+        raise HTTPException(status_code=404, detail="No readings for this network address yet")
+    return latest
+
+@app.get("/api/readings/recent")
+async def get_recent_readings(network_address: int, limit: Optional[int] = Query(None, ge=1)):
+    return {"network_address": network_address, "readings": reading_cache.get_recent(network_address, limit)}
+
+# Time-range history for one device with keyset pagination. Pass next_cursor
+# back as cursor to get the following page.
+@app.get("/api/readings")
+def get_readings(network_address: int,
+                 start: Optional[datetime] = None,
+                 end: Optional[datetime] = None,
+                 limit: int = Query(500, ge=1, le=10000),
+                 cursor: Optional[str] = None,
+                 order: str = Query("asc", pattern="^(asc|desc)$"),
+                 db: Session = Depends(get_db)):
+    try:
+        rows, next_cursor = query_readings(db, network_address, start, end, limit, cursor, descending=order == "desc")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {
+        "network_address": network_address,
+        "readings": [
+            {
+                "id": r.id,
+                "timestamp": r.timestamp.isoformat(),
+                "dust": r.dust_concentration,
+                "temp": r.pcb_temp,
+                "current": r.current_loop,
+                "ld": r.laser_diode_signal,
+                "pd": r.photo_diode_signal,
+            } for r in rows
+        ],
+        "next_cursor": next_cursor,
+    }
+# Downsampled chart data for any window: one min/max/mean/last point per bucket,
+# aggregated in the database. Defaults to the last 24 hours in ~500 points.
+@app.get("/api/readings/aggregate")
+def get_readings_aggregate(network_address: int,
+                           start: Optional[datetime] = None,
+                           end: Optional[datetime] = None,
+                           points: int = Query(500, ge=1, le=5000),
+                           bucket_seconds: Optional[int] = Query(None, ge=1),
+                           db: Session = Depends(get_db)):
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    width = bucket_seconds or bucket_width(start, end, points)
+    # Coarsest rollup that still resolves the bucket width, raw readings below a
+    # minute, moving to a coarser table where retention pruned the finer one
+    rollup = pick_rollup(width, start, retention_policy.limits)
+    if rollup is not None:
+        width, result = aggregate_rollups(db, rollup, network_address, start, end, width)
+        source = rollup.__tablename__
+    else:
+        result = aggregate_readings(db, network_address, start, end, width)
+        source = "readings"
+    return {
+        "network_address": network_address,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "bucket_seconds": width,
+        "source": source,
+        "points": result,
+    }
+
+# Server-Sent Events feed of newly ingested readings for one device. Event ids
+# are reading ids: a reconnecting EventSource sends Last-Event-ID and gets only
+# what it missed (last_event_id in the query does the same for a first connect).
+@app.get("/api/readings/stream")
+async def stream_readings(request: Request,
+                          network_address: int,
+                          last_event_id: Optional[int] = None):
+    header = request.headers.get("last-event-id")
+    if header:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    return StreamingResponse(
+        live_feed.stream_readings(live_feed.broker, network_address, last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Bulk download of raw readings, streamed chunk by chunk from a server-side
+# cursor so memory stays flat whatever the range. format=arrow needs pyarrow.
+@app.get("/api/readings/export")
+def export_readings(network_address: Optional[int] = None,
+                    start: Optional[datetime] = None,
+                    end: Optional[datetime] = None,
+                    format: str = Query("csv", pattern="^(csv|arrow)$"),
+                    chunk_size: int = Query(export.DEFAULT_CHUNK_SIZE, ge=100, le=100000)):
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if format == "arrow" and export.pa is None:
+        raise HTTPException(status_code=501, detail="Arrow export needs the optional pyarrow package")
+    chunks, media_type, extension = export.EXPORT_FORMATS[format]
+    filename = f"readings_{network_address if network_address is not None else 'all'}.{extension}"
+    return StreamingResponse(
+        chunks(network_address, start, end, chunk_size),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Fastest continuous stream: a C9 round trip takes ~50 ms at 9600 baud, so the
+# shared poller always has time to finish one read before the next is due
+MIN_STREAM_PERIOD = load_config().get("websocket", {}).get("min_period_seconds", 0.2)
+
+def to_number(value):
+    """value as a finite float (numeric strings included), else None."""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+def to_address(value):
+    """value as a network address, an int 0..65535 (integral numbers and
+    numeric strings included), else None."""
+    number = to_number(value)
+    if number is None or not number.is_integer() or not 0 <= number <= 0xFFFF:
+        return None
+    return int(number)
 
 @app.websocket("/ws/sensor")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     continuous_task = None
+    subscription = None
     try:
         while True:
             # Receive configuration from frontend
@@ -258,301 +617,209 @@ async def websocket_endpoint(websocket: WebSocket):
             is_continuous = data.get("continuous", False)
             network_address = data.get("network_address", 0)
             period = data.get("period_in_seconds", 2)
-
-            # Cancel any existing continuous task
+            port = data.get("port")
+            # Message encoding, see ws_codec.py. JSON with raw hex unless asked otherwise
+            fmt = data.get("format", "json")
+            include_raw = data.get("include_raw", True)
+            # Only push readings whose dust value moved by more than this
+            min_delta = data.get("min_delta")
+            format_error = ws_codec.check_format(fmt)
+            if format_error:
+                await websocket.send_json({"error": format_error})
+                continue
+            network_address = to_address(network_address)
+            if network_address is None:
+                await websocket.send_json({"error": "network_address must be an integer 0..65535"})
+                continue
+            period = to_number(period)
+            if period is None or period < MIN_STREAM_PERIOD:
+                await websocket.send_json({"error": f"period_in_seconds must be a number >= {MIN_STREAM_PERIOD}"})
+                continue
+            if min_delta is not None:
+                min_delta = to_number(min_delta)
+                if min_delta is None or min_delta < 0:
+                    await websocket.send_json({"error": "min_delta must be a number >= 0"})
+                    continue
+
+            # Cancel any existing continuous task and leave its poller
             if continuous_task:
                 continuous_task.cancel()
                 continuous_task = None
+            if subscription:
+                sensor_poller.unsubscribe(subscription)
+                subscription = None
 
-            # Determine bytes 5 and 6 logic
             if is_continuous:
-                # Assuming period * 10 for continuous mode as per your logic
-                freq_byte = int(period * 10)
-                # Ensure it stays within single byte range if that's device spec
-                byte5, byte6 = freq_byte & 0xFF, 0x00
-            else:
-                # Value > 250 for bytes 5 and 6 signals single-shot
-                byte5, byte6 = 0xFF, 0xFF 
-
-            # Construct Command
-            net_h, net_l = (network_address >> 8) & 0xFF, network_address & 0xFF
-            cmd_list = [0xFA, net_h, net_l, 0xC9, byte5, byte6]
-            cmd_list.append(sum(cmd_list) % 0x100)
-            cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
+                # Continuous mode joins the shared poller for this address, so
+                # N viewers of one sensor still mean one read per tick on the bus
+                client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+                try:
+                    subscription = await sensor_poller.subscribe(network_address, period, port, min_delta, client)
+                except (UnknownPortError, NotConnectedError) as e:
+                    await websocket.send_json({"error": str(e)})
+                    continue
 
-            if is_continuous:
-                # For continuous mode, create a task that keeps sending
-                async def send_continuous_data():
+                async def send_continuous_data(subscription, fmt, include_raw):
+                    # Runs apart from the poll loop; while a send is slow, newer
+                    # frames overwrite the subscription's slot instead of queueing
+                    loop = asyncio.get_running_loop()
                     try:
                         while True:
-                            try:
-                                resp_hex = send_and_receive(cmd)
-                                parsed = decode_response(resp_hex)
-                                await websocket.send_json({"raw": resp_hex, "parsed": parsed})
-                            except Exception as e:
-                                await websocket.send_json({"error": str(e)})
-                            await asyncio.sleep(period)
+                            message = await subscription.get()
+                            await ws_codec.send_encoded(websocket, message, fmt, include_raw)
+                            subscription.sent(loop.time())
+                            if subscription.closed:
+                                break
                     except asyncio.CancelledError:
                         pass
-                
-                continuous_task = asyncio.create_task(send_continuous_data())
+
+                continuous_task = asyncio.create_task(send_continuous_data(subscription, fmt, include_raw))
             else:
+                # Value > 250 for bytes 5 and 6 signals single-shot
+                cmd = encode_command(network_address, 0xC9, 0xFF, 0xFF)
+
                 # For single-shot, just send once
                 try:
-                    resp_hex = send_and_receive(cmd)
-                    parsed = decode_response(resp_hex)
-                    await websocket.send_json({"raw": resp_hex, "parsed": parsed})
+                    resp = await transact_async(cmd, port=port)
+                    message = {"raw": resp.hex(), "parsed": decode_frame(resp)}
                 except Exception as e:
-                    await websocket.send_json({"error": str(e)})
+                    message = {"error": str(e)}
+                await ws_codec.send_encoded(websocket, message, fmt, include_raw)
                 # Close the websocket after single-shot response
                 await websocket.close()
                 break  # Exit the loop after closing
-                    
+
     except WebSocketDisconnect:
+        logging.debug("WebSocket client disconnected")
+    finally:
         if continuous_task:
             continuous_task.cancel()
-        print("Client disconnected")    
+        if subscription:
+            sensor_poller.unsubscribe(subscription)
 
 # Read System Info
 @app.get("/api/read-system-info")
-async def read_system_info():
-    cmd = "fa ff ff 98 00 00 90"
+async def read_system_info(port: Optional[str] = None, refresh: bool = False):
+    # Served from the cache until a set-* command changes the device, or refresh=true
+    cache_key = await system_info_port(port)
+    if not refresh:
+        cached = system_info_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "cached": True}
+    cmd = encode_command(0xFFFF, 0x98)
 
-    resp_hex = send_and_receive(cmd)
-    parsed = decode_response(resp_hex)
-    result_data = {"raw": resp_hex, "parsed": parsed}
-    print(result_data)
-    return result_data
+    try:
+        resp = await transact_async(cmd, port=port)
+    except UnknownPortError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotConnectedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    parsed = decode_frame(resp)
+    result_data = {"raw": resp.hex(), "parsed": parsed}
+    logging.debug("read-system-info result %s", result_data)
+    if "error" not in parsed:
+        system_info_cache.put(cache_key, result_data)
+    return {**result_data, "cached": False}
+
+async def system_info_port(port):
+    try:
+        return await resolve_port_async(port)
+    except Exception:
+        return port
 
-# Set Network Address
-@app.post("/api/set-network-address")
-async def set_network_address(data: NetworkAddressModel):
-    cmd_list = [0xFA, 0xFF, 0xFF, 0x97]
-    byte_5 = (data.address >> 8) & 0xFF
-    byte_6 = data.address & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
+# Commands that only read from the device, everything else may change its config
+READ_COMMANDS = {0xC9, 0x98}
 
+# Send a command frame and return the raw (hex only here, at the JSON boundary) and decoded response
+async def run_command(cmd, port):
     try:
-        print('*****************calling send_and_receive with cmd:', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
+        logging.debug("Sending command %s", cmd.hex(' '))
+        resp = await transact_async(cmd, port=port)
+        parsed = decode_frame(resp)
+        result_data = {"raw": resp.hex(), "parsed": parsed}
+        logging.debug("Command result %s", result_data)
+    except UnknownPortError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotConnectedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Even a failed or timed out write may have reached the device, drop the stale info
+        if cmd[3] not in READ_COMMANDS:
+            system_info_cache.invalidate(await system_info_port(port))
+    return result_data
+
+# Set Network Address
+@app.post("/api/set-network-address")
+async def set_network_address(data: NetworkAddressModel):
+    cmd = encode_value_command(0xFFFF, 0x97, data.address)
+    return await run_command(cmd, data.port)
 
 # Set Smoothing Time
 @app.post("/api/set-smoothing-time")
 async def set_smoothing_time(data: SmoothingTimeModel):
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
-    cmd_list = [0xFA, network_address_high, network_address_low, 0x8C]
-
     smoothing_time = data.smoothtime_in_seconds
-    
-    byte_5 = (smoothing_time >> 8) & 0xFF
-    byte_6 = smoothing_time & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    try:
-        print('*****************calling send_and_receive with cmd:', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    cmd = encode_value_command(data.network_address, 0x8C, smoothing_time)
+    return await run_command(cmd, data.port)
     
 # Set Range
 @app.post("/api/set-range")
 async def set_range(data: RangeModel):
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
-    cmd_list = [0xFA, network_address_high, network_address_low, 0x9D]
-
     range_value = data.max_range_value
-
-    byte_5 = (range_value >> 8) & 0xFF
-    byte_6 = range_value & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    try:
-        print('*****************calling send_and_receive with cmd --> ', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    cmd = encode_value_command(data.network_address, 0x9D, range_value)
+    return await run_command(cmd, data.port)
     
 @app.post("/api/set-alarm")
 async def set_alarm(data: AlarmModel):
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
-    cmd_list = [0xFA, network_address_high, network_address_low, 0x9A]
-
     threshold_value = int(data.threshold_value)  # Assuming the device expects the value multiplied by 100
-
-    byte_5 = (threshold_value >> 8) & 0xFF
-    byte_6 = threshold_value & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    try:
-        print('*****************calling send_and_receive with cmd --> ', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    cmd = encode_value_command(data.network_address, 0x9A, threshold_value)
+    return await run_command(cmd, data.port)
     
 # Set Data Calibration A
 @app.post("/api/set-data-calibration")
 async def set_data_calibration(data: CalibrationAModel):
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
     if data.calibration_type == "A":
-        cmd_list = [0xFA, network_address_high, network_address_low, 0xCF]
+        cmd_id = 0xCF
         calibration_value = int(data.calibration_value * 1000)  # Assuming the device expects the value multiplied by 1000
     elif data.calibration_type == "B":
-        cmd_list = [0xFA, network_address_high, network_address_low, 0xD0]
+        cmd_id = 0xD0
         calibration_value = int(data.calibration_value * 10)  # Assuming the device expects the value multiplied by 10
+    else:
+        raise HTTPException(status_code=400, detail="calibration_type must be A or B")
 
-    
-    print("calibration_value --> ", calibration_value)
-
-    byte_5 = (calibration_value >> 8) & 0xFF
-    byte_6 = calibration_value & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    try:
-        print('*****************calling send_and_receive with cmd:', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    logging.debug("calibration_value %s", calibration_value)
+    cmd = encode_value_command(data.network_address, cmd_id, calibration_value)
+    return await run_command(cmd, data.port)
      
 @app.post("/api/set-correction-value")
 async def set_correction_value(data: CorrectValueModel):
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
-    cmd_list = [0xFA, network_address_high, network_address_low, 0x9E]
-
     correction_value = data.correction_value
-    byte_5 = (correction_value >> 8) & 0xFF
-    byte_6 = correction_value & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    try:
-        print('*****************calling send_and_receive with cmd:', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    cmd = encode_value_command(data.network_address, 0x9E, correction_value)
+    return await run_command(cmd, data.port)
     
 @app.post("/api/set-cancel-correction-value")
 async def set_cancel_correction_value(data: CorrectValueModel):
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
-    cmd_list = [0xFA, network_address_high, network_address_low, 0xA5]
-
-    correction_value = 0  # Setting correction value to 0 to cancel
-    byte_5 = (correction_value >> 8) & 0xFF
-    byte_6 = correction_value & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    try:
-        print('*****************calling send_and_receive with cmd:', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Setting correction value to 0 to cancel
+    cmd = encode_value_command(data.network_address, 0xA5, 0)
+    return await run_command(cmd, data.port)
+
+CALIBRATION_COMMANDS = {
+    "manual-zero-calibration": 0xD1,
+    "cancel-zero-calibration": 0xD2,
+    "range-calibration": 0xD3,
+}
     
 @app.post("/api/set-calibration-setup")
 async def set_calibration_setup(data: deviceCalibrationModel):
-    network_address_high = (data.network_address >> 8) & 0xFF
-    network_address_low = data.network_address & 0xFF
-    if data.calibration_type == "manual-zero-calibration":
-        cmd_list = [0xFA, network_address_high, network_address_low, 0xD1]
-    elif data.calibration_type == "cancel-zero-calibration":
-        cmd_list = [0xFA, network_address_high, network_address_low, 0xD2]
-    elif data.calibration_type == "range-calibration":
-        cmd_list = [0xFA, network_address_high, network_address_low, 0xD3]
-    
-    calibration_value = 0  # No additional value needed for these commands
-
-    byte_5 = (calibration_value >> 8) & 0xFF
-    byte_6 = calibration_value & 0xFF
-    cmd_list.append(byte_5)
-    cmd_list.append(byte_6)
-
-    checksum = (sum(cmd_list) % 0x100)
-    cmd_list.append(checksum)
-
-    cmd = ' '.join(f"{byte:02x}" for byte in cmd_list)
-
-    try:
-        print('*********calling send_and_receive with cmd:', cmd)
-        resp_hex = send_and_receive(cmd)
-        parsed = decode_response(resp_hex)
-        result_data = {"raw": resp_hex, "parsed": parsed}
-        print(result_data)
-        return result_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    cmd_id = CALIBRATION_COMMANDS.get(data.calibration_type)
+    if cmd_id is None:
+        raise HTTPException(status_code=400, detail="Unknown calibration_type")
+    # No additional value needed for these commands
+    cmd = encode_command(data.network_address, cmd_id)
+    return await run_command(cmd, data.port)
 #Uncomment below to run FastAPI with webview directly from this file
 # if __name__ == "__main__":
 #     threading.Thread(target=run_fastapi, daemon=True).start()
@@ -0,0 +1,70 @@
+"""Helpers shared by the benchmark scripts."""
+import os, platform, subprocess, sys, time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+DROP_FLAG = "--i-know-this-drops-tables"
+
+
+def check_scratch(engine, drop_tables=False):
+    """Raise RuntimeError if the database the benchmark is about to drop and
+    recreate the readings tables in has rows in them, unless drop_tables."""
+    if drop_tables:
+        return
+    from sqlalchemy import inspect, select
+    from database import Base
+    existing = set(inspect(engine).get_table_names())
+    with engine.connect() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name in existing and conn.execute(select(table).limit(1)).first() is not None:
+                raise RuntimeError(f"{engine.url!r} has rows in {table.name}, which the benchmark drops; "
+                                   f"use an empty scratch database or pass {DROP_FLAG}")
+
+
+def latency_summary(samples):
+    """p50/p95/p99/mean/max of a list of durations in seconds, as milliseconds."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def timed(fn, *args, repeat=100):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def environment():
+    """Where the numbers came from, stored next to them."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
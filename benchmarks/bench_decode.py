@@ -0,0 +1,74 @@
+"""Decode throughput: legacy hex/if-elif path vs the bytes codec in protocol.py.
+
+    python benchmarks/bench_decode.py [--frames 200000]
+"""
+import argparse, json, os, struct, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import decode_frame, frame_checksum  # noqa: E402
+
+
+def make_c9_frame(network_address=16, dust=12.5):
+    b = bytearray(39)
+    b[0], b[1], b[4], b[-1] = 0xFA, 39, 0xC9, 0xF5
+    b[2:4] = network_address.to_bytes(2, "big")
+    b[5:7], b[7:9] = (100).to_bytes(2, "big"), (200).to_bytes(2, "big")
+    b[19:21] = (1065).to_bytes(2, "big")
+    b[25:29] = struct.pack(">f", dust)
+    b[33:35] = (1234).to_bytes(2, "big")
+    b[-2] = frame_checksum(b)
+    return bytes(b)
+
+
+def legacy_decode_c9(hexstr):
+    # The C9 branch of decode_response before the codec, kept as the baseline
+    b = bytes.fromhex(hexstr)
+    if len(b) >= 2 and b[0] != 0xFA:
+        return {"error": "invalid start byte in Response"}
+    if len(b) >= 2 and b[-1] != 0xF5:
+        return {"error": "invalid end byte in Response"}
+    decoded_resp = {}
+    if b[4] == 0xC9:
+        if len(b) < 39:
+            return {"error": "incomplete response for command C9"}
+        if sum(b[:-2]) % 0x100 != b[-2]:
+            return {"error": "Checksum failed"}
+        decoded_resp["network_address"] = int.from_bytes(b[2:4], "big")
+        decoded_resp["ld"] = int.from_bytes(b[5:7], "big")
+        decoded_resp["pd"] = int.from_bytes(b[7:9], "big")
+        decoded_resp["pcb_temperature"] = round(25 - (int.from_bytes(b[19:21], "big") - 1065) * 1025 / 4096, 2)
+        decoded_resp["dust_concentration"] = round(struct.unpack(">f", b[25:29])[0], 2)
+        decoded_resp["current_loop"] = int.from_bytes(b[33:35], "big") / 100
+    return decoded_resp
+
+
+def measure(name, fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    elapsed = time.perf_counter() - start
+    return {"name": name, "frames": len(items), "seconds": round(elapsed, 4), "frames_per_sec": round(len(items) / elapsed)}
+
+
+def run(frames=200000):
+    frame = make_c9_frame()
+    hex_frames = [frame.hex(" ")] * frames
+    buffer = memoryview(frame * frames)
+    views = [buffer[i:i + 39] for i in range(0, len(buffer), 39)]
+    results = [
+        measure("legacy_hex_if_elif", legacy_decode_c9, hex_frames),
+        measure("decode_frame_bytes", decode_frame, [frame] * frames),
+        measure("decode_frame_memoryview", decode_frame, views),
+    ]
+    baseline = results[0]["frames_per_sec"]
+    for result in results:
+        result["speedup"] = round(result["frames_per_sec"] / baseline, 2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=200000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.frames), indent=2))
@@ -0,0 +1,66 @@
+"""Import-time budget: cold import of each module in a fresh interpreter.
+
+    python benchmarks/bench_import.py [--repeat 5]
+
+Takes the best of --repeat runs per module and exits non-zero when a module
+is over its budget, or when importing it created an engine or a database
+file (the DB is only opened by database.init_db()/get_engine()).
+"""
+import argparse, json, os, subprocess, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds, best-of-N measurements with ~1.5x headroom. protocol and
+# device_communicator must stay clear of SQLAlchemy (~300 ms on its own).
+BUDGETS_MS = {
+    "protocol": 20,
+    "device_communicator": 150,
+    "database": 500,
+    "app": 1500,
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+database = sys.modules.get("database")
+print(json.dumps({{"ms": elapsed, "engine": bool(database and database._engine is not None)}}))
+"""
+
+
+def measure(module, repeat, db_path):
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}"}
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=ROOT, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    best = min(run["ms"] for run in runs)
+    return {
+        "module": module,
+        "best_ms": round(best, 1),
+        "budget_ms": BUDGETS_MS[module],
+        "engine_created": any(run["engine"] for run in runs),
+        "db_file_created": os.path.exists(db_path),
+    }
+
+
+def run(repeat=5):
+    results = []
+    for module in BUDGETS_MS:
+        with tempfile.TemporaryDirectory() as tmp:
+            result = measure(module, repeat, os.path.join(tmp, "import_probe.db"))
+        result["ok"] = (result["best_ms"] <= result["budget_ms"]
+                        and not result["engine_created"] and not result["db_file_created"])
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    results = run(args.repeat)
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
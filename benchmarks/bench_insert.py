@@ -0,0 +1,102 @@
+"""Insert throughput on SQLite: default settings vs the tuned profile in database.py.
+
+    python benchmarks/bench_insert.py [--rows 2000] [--batch-rows N] [--batch 500] [--url URL [--i-know-this-drops-tables]]
+
+--rows sizes the one-commit-per-row case and --batch-rows (default 10x
+--rows) the batched one. Each case runs against a fresh database file in a
+temporary directory, or with --url against a scratch server database
+(tables created and dropped, so they must be empty or absent unless
+--i-know-this-drops-tables is given).
+"""
+import argparse, json, os, sys, tempfile, time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from bench_common import DROP_FLAG, check_scratch  # noqa: E402
+from database import Base, DeviceReading, make_engine  # noqa: E402
+
+PROFILES = {
+    "default": {"sqlite": {"enabled": False}},
+    "tuned": {},
+}
+
+
+def make_row(i):
+    return {
+        "timestamp": datetime.now(timezone.utc),
+        "network_address": 16 + i % 4,
+        "dust_concentration": 12.5,
+        "pcb_temp": 25.0,
+        "current_loop": 12.34,
+        "laser_diode_signal": 100,
+        "photo_diode_signal": 200,
+    }
+
+
+def single_row_commits(session, rows):
+    # What /api/store-reading did before the write-behind queue
+    for i in range(rows):
+        session.add(DeviceReading(**make_row(i)))
+        session.commit()
+
+
+def batched_commits(session, rows, batch):
+    for offset in range(0, rows, batch):
+        session.execute(insert(DeviceReading), [make_row(i) for i in range(offset, min(rows, offset + batch))])
+        session.commit()
+
+
+def measure(profile, case, fn, rows, url=None, drop_tables=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(url or f"sqlite:///{tmp}/bench.db", PROFILES[profile])
+        if url:
+            check_scratch(engine, drop_tables)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        try:
+            start = time.perf_counter()
+            fn(session)
+            elapsed = time.perf_counter() - start
+        finally:
+            session.close()
+            if url:
+                Base.metadata.drop_all(engine)
+            engine.dispose()
+    return {"backend": engine.dialect.name, "profile": profile, "case": case, "rows": rows,
+            "seconds": round(elapsed, 4), "rows_per_sec": round(rows / elapsed)}
+
+
+def run(rows=2000, batch=500, url=None, batch_rows=None, drop_tables=False):
+    batch_rows = batch_rows or rows * 10
+    # The SQLite profile does not apply to a server database, run it once
+    profiles = PROFILES if url is None or url.startswith("sqlite") else ["default"]
+    results = []
+    for profile in profiles:
+        results.append(measure(profile, "single_row_commit", lambda s: single_row_commits(s, rows), rows, url,
+                               drop_tables))
+        results.append(measure(profile, f"batch_{batch}", lambda s: batched_commits(s, batch_rows, batch), batch_rows,
+                               url, drop_tables))
+    baseline = {r["case"]: r["rows_per_sec"] for r in results if r["profile"] == "default"}
+    for result in results:
+        result["speedup"] = round(result["rows_per_sec"] / baseline[result["case"]], 2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-rows", type=int, help="rows in the batched case (default 10x --rows)")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--url", help="scratch database URL, e.g. postgresql://user:pw@host/bench")
+    parser.add_argument(DROP_FLAG, dest="drop_tables", action="store_true",
+                        help="drop the readings tables at --url even if they hold rows")
+    args = parser.parse_args()
+    try:
+        print(json.dumps(run(args.rows, args.batch, args.url, args.batch_rows, args.drop_tables), indent=2))
+    except RuntimeError as e:
+        parser.error(str(e))
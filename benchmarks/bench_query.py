@@ -0,0 +1,104 @@
+"""History query latency on a large readings table.
+
+    python benchmarks/bench_query.py [--rows 1000000,10000000] [--devices 10] [--url URL [--i-know-this-drops-tables]]
+
+For each size in --rows, fills a fresh SQLite file (or the scratch database
+at --url, whose tables are dropped and recreated, so they must be empty or
+absent unless --i-know-this-drops-tables is given) with that many readings
+spread over --devices addresses at one second spacing, then times the
+history queries the API runs. Comparing 1M with 10M rows shows whether a
+query's latency depends on the table size; use --rows 50000 for a smoke run.
+"""
+import argparse, json, random, tempfile, time
+from datetime import datetime, timedelta, timezone
+
+import bench_common  # noqa: F401  (puts the repo root on sys.path)
+from bench_common import DROP_FLAG, check_scratch, timed
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from aggregation import aggregate_readings
+from database import Base, DeviceReading, make_engine, query_readings
+
+FILL_BATCH = 50000
+
+
+def fill(engine, rows, devices):
+    end = datetime.now(timezone.utc).replace(microsecond=0)
+    start = end - timedelta(seconds=rows // devices)
+    rng = random.Random(1)
+    with engine.begin() as conn:
+        for offset in range(0, rows, FILL_BATCH):
+            conn.execute(insert(DeviceReading), [
+                {
+                    "timestamp": start + timedelta(seconds=i // devices),
+                    "network_address": 16 + i % devices,
+                    "dust_concentration": rng.uniform(0, 100),
+                    "pcb_temp": 25.0,
+                    "current_loop": 12.0,
+                    "laser_diode_signal": 1000,
+                    "photo_diode_signal": 2000,
+                } for i in range(offset, min(rows, offset + FILL_BATCH))
+            ])
+    return start, end
+
+
+def run(rows=1000000, devices=10, url=None, repeat=200, drop_tables=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(url or f"sqlite:///{tmp}/bench.db")
+        if url:
+            check_scratch(engine, drop_tables)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        try:
+            started = time.perf_counter()
+            start, end = fill(engine, rows, devices)
+            fill_seconds = time.perf_counter() - started
+            session = sessionmaker(bind=engine)()
+            rng = random.Random(2)
+            span = (end - start).total_seconds()
+
+            def history():
+                # /api/get-reading-history?network_address=
+                query_readings(session, 16 + rng.randrange(devices), limit=50, descending=True)
+
+            def range_page():
+                # /api/readings, one page from a random point in time
+                page_start = start + timedelta(seconds=rng.uniform(0, span))
+                query_readings(session, 16 + rng.randrange(devices), page_start, None, 500)
+
+            def aggregate_day():
+                # /api/readings/aggregate on raw rows, last day in 500 buckets
+                aggregate_readings(session, 16 + rng.randrange(devices), end - timedelta(days=1), end, 172)
+
+            results = [
+                {"query": "history_latest_50", **timed(history, repeat=repeat)},
+                {"query": "keyset_page_500", **timed(range_page, repeat=repeat)},
+                {"query": "aggregate_raw_1d", **timed(aggregate_day, repeat=max(1, repeat // 10))},
+            ]
+            session.close()
+        finally:
+            if url:
+                Base.metadata.drop_all(engine)
+            engine.dispose()
+    for result in results:
+        result.update({"rows": rows, "devices": devices, "backend": engine.dialect.name,
+                       "fill_rows_per_sec": round(rows / fill_seconds)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", default="1000000,10000000", help="comma separated table sizes")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--url", help="scratch database URL, e.g. postgresql://user:pw@host/bench")
+    parser.add_argument(DROP_FLAG, dest="drop_tables", action="store_true",
+                        help="drop the readings tables at --url even if they hold rows")
+    args = parser.parse_args()
+    try:
+        results = [result for rows in args.rows.split(",")
+                   for result in run(int(rows), args.devices, args.url, args.repeat, args.drop_tables)]
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(json.dumps(results, indent=2))
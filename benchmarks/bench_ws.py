@@ -0,0 +1,108 @@
+"""WebSocket fan-out: how many /ws/sensor clients one server keeps on schedule.
+
+    python benchmarks/bench_ws.py [--period 0.5] [--seconds 5] [--max-clients 256]
+
+Starts the app under uvicorn with a throwaway database and a simulated bus
+(sim://, see device_simulator.py), then doubles the number of continuous
+clients on one address until the p99 gap between messages at a client goes
+past 1.5 periods. Needs the websockets package (pip install websockets).
+"""
+import argparse, asyncio, json, os, socket, subprocess, sys, tempfile, time
+import urllib.request
+
+import bench_common
+from bench_common import latency_summary
+
+NETWORK_ADDRESS = 16
+SIM_PORT = f"sim://?addresses={NETWORK_ADDRESS}&baud=115200&seed=1"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, tmp):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/bench.db", ALLOW_URL_PORTS="1")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=bench_common.ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            request = urllib.request.Request(f"http://127.0.0.1:{port}/api/connect-device?port={SIM_PORT}",
+                                             method="POST", data=b"")
+            with urllib.request.urlopen(request, timeout=2):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("server did not come up")
+
+
+async def client(url, period, seconds, gaps, arrivals):
+    import websockets
+
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({"continuous": True, "network_address": NETWORK_ADDRESS,
+                                  "period_in_seconds": period, "port": SIM_PORT}))
+        last = None
+        deadline = time.monotonic() + seconds
+        while True:
+            try:
+                message = await asyncio.wait_for(ws.recv(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                return
+            now = time.monotonic()
+            # The raw frame identifies one poll, every client gets the same bytes
+            arrivals.setdefault(json.loads(message).get("raw"), []).append(now)
+            if last is not None:
+                gaps.append(now - last)
+            last = now
+
+
+async def step(url, clients, period, seconds):
+    gaps, arrivals = [], {}
+    await asyncio.gather(*(client(url, period, seconds, gaps, arrivals) for _ in range(clients)))
+    # Fan-out skew: spread of arrival times of one reading across clients
+    skews = [max(times) - min(times) for times in arrivals.values() if len(times) == clients]
+    return {"clients": clients, "interval": latency_summary(gaps), "skew": latency_summary(skews)}
+
+
+def run(period=0.5, seconds=5.0, max_clients=256):
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        return {"skipped": "websockets is not installed"}
+    port = free_port()
+    url = f"ws://127.0.0.1:{port}/ws/sensor"
+    steps = []
+    with tempfile.TemporaryDirectory() as tmp:
+        server = start_server(port, tmp)
+        try:
+            clients = 1
+            while clients <= max_clients:
+                result = asyncio.run(step(url, clients, period, seconds))
+                steps.append(result)
+                if result["interval"].get("p99_ms", float("inf")) > period * 1500:
+                    break
+                clients *= 2
+        finally:
+            server.terminate()
+            server.wait(10)
+    on_schedule = [s["clients"] for s in steps if s["interval"].get("p99_ms", float("inf")) <= period * 1500]
+    return {"period_s": period, "max_clients_on_schedule": max(on_schedule, default=0), "steps": steps}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--period", type=float, default=0.5)
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each step")
+    parser.add_argument("--max-clients", type=int, default=256)
+    args = parser.parse_args()
+    print(json.dumps(run(args.period, args.seconds, args.max_clients), indent=2))
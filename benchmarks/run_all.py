@@ -0,0 +1,99 @@
+"""Run the benchmark suites and store the results as JSON, or compare two runs.
+
+    python benchmarks/run_all.py [--quick] [--only decode,query] [--url URL [--i-know-this-drops-tables]] [--out FILE]
+    python benchmarks/run_all.py --compare old.json new.json
+
+Results go to benchmarks/results/<UTC timestamp>.json by default, together
+with the commit and machine they came from. The query suite runs against
+1M and 10M-row tables, which takes a while; --quick uses a table small
+enough for a smoke run. --compare prints, for every metric present in both
+files, the new value over the old one.
+"""
+import argparse, json, os, sys
+from datetime import datetime, timezone
+
+import bench_common
+import bench_decode, bench_import, bench_insert, bench_query, bench_ws
+
+RESULTS_DIR = os.path.join(bench_common.ROOT, "benchmarks", "results")
+
+# suite -> (full run, --quick run); each takes the --url scratch database and
+# whether it may drop readings tables there that hold rows
+SUITES = {
+    "decode": (lambda url, drop: bench_decode.run(200000), lambda url, drop: bench_decode.run(20000)),
+    "insert": (lambda url, drop: bench_insert.run(2000, 500, url, drop_tables=drop),
+               lambda url, drop: bench_insert.run(200, 100, url, drop_tables=drop)),
+    "query": (lambda url, drop: bench_query.run(1000000, 10, url, drop_tables=drop)
+              + bench_query.run(10000000, 10, url, drop_tables=drop),
+              lambda url, drop: bench_query.run(50000, 10, url, 50, drop)),
+    "ws": (lambda url, drop: bench_ws.run(0.5, 5.0, 256), lambda url, drop: bench_ws.run(0.5, 2.0, 16)),
+    "import": (lambda url, drop: bench_import.run(5), lambda url, drop: bench_import.run(2)),
+}
+
+# Fields that name a row in a suite's result list rather than measure it
+LABELS = ("name", "case", "profile", "query", "rows", "module", "backend", "clients")
+
+
+def flatten(value, prefix="", row=False):
+    """Numeric leaves of a result as {"suite.row.metric": number}."""
+    metrics = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            # Labels name the row (suite names like "query" are not labels)
+            if not (row and key in LABELS):
+                metrics.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            label = index
+            if isinstance(item, dict):
+                label = "/".join(str(item[key]) for key in LABELS if key in item) or index
+            metrics.update(flatten(item, f"{prefix}[{label}]", row=True))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        metrics[prefix] = value
+    return metrics
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = flatten(json.load(f)["results"])
+    with open(new_path) as f:
+        new = flatten(json.load(f)["results"])
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key] / old[key] if old[key] else float("inf") if new[key] else 1.0
+        print(f"{key:70} {old[key]:>12} {new[key]:>12} {ratio:>8.2f}x")
+
+
+def run(names, quick=False, url=None, drop_tables=False):
+    report = {"environment": bench_common.environment(), "quick": quick, "results": {}}
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        report["results"][name] = SUITES[name][1 if quick else 0](url, drop_tables)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke run")
+    parser.add_argument("--only", help=f"comma separated subset of {','.join(SUITES)}")
+    parser.add_argument("--url", help="scratch database URL for insert and query (default: temporary SQLite)")
+    parser.add_argument(bench_common.DROP_FLAG, dest="drop_tables", action="store_true",
+                        help="drop the readings tables at --url even if they hold rows")
+    parser.add_argument("--out", help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    names = args.only.split(",") if args.only else list(SUITES)
+    unknown = set(names) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    try:
+        report = run(names, args.quick, args.url, args.drop_tables)
+    except RuntimeError as e:
+        parser.error(str(e))
+    out = args.out or os.path.join(RESULTS_DIR, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(out)
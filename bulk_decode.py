@@ -0,0 +1,85 @@
+import argparse, json, sys
+
+import numpy as np
+
+from protocol import C9_FRAME
+
+# Column view of one C9 response frame, offsets match protocol.C9_FRAME
+C9_DTYPE = np.dtype([
+    ("start", "u1"),
+    ("length", "u1"),
+    ("network_address", ">u2"),
+    ("cmd", "u1"),
+    ("ld", ">u2"),
+    ("pd", ">u2"),
+    ("_reserved1", "V10"),
+    ("temp_raw", ">u2"),
+    ("_reserved2", "V4"),
+    ("dust", ">f4"),
+    ("_reserved3", "V4"),
+    ("current", ">u2"),
+    ("_reserved4", "V2"),
+    ("checksum", "u1"),
+    ("end", "u1"),
+])
+assert C9_DTYPE.itemsize == C9_FRAME.size
+
+
+def decode_c9_frames(data):
+    """Decode a contiguous buffer of fixed-length C9 response frames.
+
+    data may be bytes, a memoryview, a uint8 NumPy array or a memmap. Every
+    frame is validated and decoded column-wise in one pass. Returns a dict of
+    arrays with the same fields as decode_response plus a "valid" mask;
+    values in rejected rows are meaningless. Trailing bytes that do not fill a
+    whole frame are ignored and reported as "trailing_bytes".
+    """
+    raw = data.reshape(-1) if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.uint8)
+    count = raw.size // C9_DTYPE.itemsize
+    frames = np.ascontiguousarray(raw[:count * C9_DTYPE.itemsize]).reshape(count, C9_DTYPE.itemsize)
+    records = frames.view(C9_DTYPE).reshape(count)
+
+    checksum_ok = frames[:, :-2].sum(axis=1, dtype=np.uint32) % 0x100 == frames[:, -2]
+    framing_ok = (
+        (records["start"] == 0xFA)
+        & (records["end"] == 0xF5)
+        & (records["length"] == C9_DTYPE.itemsize)
+        & (records["cmd"] == 0xC9)
+    )
+    return {
+        "network_address": records["network_address"].astype(np.uint16),
+        "ld": records["ld"].astype(np.uint16),
+        "pd": records["pd"].astype(np.uint16),
+        "pcb_temperature": np.round(25 - (records["temp_raw"].astype(np.float64) - 1065) * 1025 / 4096, 2),
+        "dust_concentration": np.round(records["dust"].astype(np.float64), 2),
+        "current_loop": records["current"].astype(np.float64) / 100,
+        "valid": framing_ok & checksum_ok,
+        "bad_framing": ~framing_ok,
+        "bad_checksum": framing_ok & ~checksum_ok,
+        "trailing_bytes": raw.size - count * C9_DTYPE.itemsize,
+    }
+
+
+def decode_c9_file(path):
+    """Memory-map a capture file of back-to-back C9 frames and decode it."""
+    return decode_c9_frames(np.memmap(path, dtype=np.uint8, mode="r"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk decode a capture of fixed-length C9 frames")
+    parser.add_argument("capture", help="binary file of back-to-back 39-byte C9 responses")
+    parser.add_argument("--out", help="write the columns to this .npz file")
+    args = parser.parse_args()
+
+    columns = decode_c9_file(args.capture)
+    summary = {
+        "frames": int(columns["valid"].size),
+        "valid": int(columns["valid"].sum()),
+        "bad_framing": int(columns["bad_framing"].sum()),
+        "bad_checksum": int(columns["bad_checksum"].sum()),
+        "trailing_bytes": int(columns["trailing_bytes"]),
+    }
+    if args.out:
+        np.savez(args.out, **{k: v for k, v in columns.items() if isinstance(v, np.ndarray)})
+    json.dump(summary, sys.stdout)
+    print()
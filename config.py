@@ -0,0 +1,28 @@
+import copy, json, os, sys, threading
+
+if getattr(sys, 'frozen', False):
+    # If compiled, the base path is the executable's folder
+    BASE = os.path.dirname(sys.executable)
+else:
+    # If running as a script, the base path is the current file's folder
+    BASE = os.path.dirname(os.path.abspath(__file__))
+
+CONFIG_PATH = os.path.join(BASE, "config.json")
+
+
+# Parsed config.json, re-read only when the file's mtime changes: the serial
+# command path looks up settings on the event loop for every command
+_cache = (None, None)
+_cache_lock = threading.Lock()
+
+
+def load_config():
+    global _cache
+    mtime = os.stat(CONFIG_PATH).st_mtime_ns
+    with _cache_lock:
+        if _cache[0] != mtime:
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                _cache = (mtime, json.load(f))
+        config = _cache[1]
+    # Callers get their own copy to modify
+    return copy.deepcopy(config)
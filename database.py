@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, Float, DateTime, create_engine, func
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Integer, Float, DateTime, Index, create_engine, event, and_, or_
+from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime, timezone
-import os, sys
+import logging, os, sys, threading, time
+
+from config import load_config
+from metrics import DB_COMMIT_SECONDS
 
 # SQLite database file path
 
@@ -15,37 +17,31 @@ def get_db_path():
     if getattr(sys, 'frozen', False):
         # On Windows, this points to C:\Users\Username\AppData\Local
         base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
-        print("database.frozen.false", base_dir)
+        logging.debug("database.frozen.true %s", base_dir)
     else:
         # During development, keep it in the script directory
         base_dir = os.path.dirname(os.path.abspath(__file__))
-        print("database.frozen.true", base_dir)
+        logging.debug("database.frozen.false %s", base_dir)
 
     # Create a dedicated subfolder if it doesn't exist
     data_dir = os.path.join(base_dir, app_name)
-    print("database.datadir", data_dir)
+    logging.debug("database.datadir %s", data_dir)
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
-        print("database.path.notexist", data_dir)
+        logging.debug("database.path.notexist %s", data_dir)
     db_path = os.path.join(data_dir, "dustmonitor.db")
-    print("database.db_path", db_path)
+    logging.debug("database.db_path %s", db_path)
     return db_path
 
-DATABASE_URL = os.environ.get("DATABASE_URL")
-print("database.DATABASE_URL", DATABASE_URL)
-# DATABASE_URL = 'Something'
-
-if not DATABASE_URL:
-    db_path = get_db_path()
-    normalized_path = db_path.replace(os.sep, '/')
-    DATABASE_URL = f"sqlite:///{normalized_path}"
-    print("Final Databaseurl: ", DATABASE_URL)
-else:
-    print('DATABASE URL set to', DATABASE_URL)
-
-connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+def get_database_url():
+    """DATABASE_URL from the environment, else the SQLite file from get_db_path()."""
+    database_url = os.environ.get("DATABASE_URL")
+    # DATABASE_URL = 'Something'
+    if not database_url:
+        normalized_path = get_db_path().replace(os.sep, '/')
+        database_url = f"sqlite:///{normalized_path}"
+    logging.info("DATABASE_URL set to %s", database_url)
+    return database_url
 
 # if DATABASE_URL and DATABASE_URL.startswith("postgresql"):
 #     # SQLAlchemy requires 'postgresql://' not 'postgres://' (Supabase sometimes provides the latter)
@@ -56,13 +52,103 @@ if DATABASE_URL.startswith("sqlite"):
 #     normalized_path = db_path.replace(os.sep, '/')
 #     DATABASE_URL = f"sqlite:///{normalized_path}"
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+# Tuning applied to every new SQLite connection. WAL lets readers run
+# alongside the single writer, synchronous=NORMAL only fsyncs at WAL
+# checkpoints (still crash safe, a power cut may lose the last commits).
+SQLITE_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout_ms": 5000,
+    "cache_size_kb": 20000,
+    "mmap_size_mb": 256,
+    "temp_store": "MEMORY",
+}
+
+def sqlite_pragmas(profile):
+    """PRAGMA statements for a profile in the config.json "database.sqlite" format."""
+    profile = {**SQLITE_PROFILE, **profile}
+    return [
+        f"PRAGMA journal_mode = {profile['journal_mode']}",
+        f"PRAGMA synchronous = {profile['synchronous']}",
+        f"PRAGMA busy_timeout = {int(profile['busy_timeout_ms'])}",
+        f"PRAGMA cache_size = -{int(profile['cache_size_kb'])}",  # negative means KiB, not pages
+        f"PRAGMA mmap_size = {int(profile['mmap_size_mb']) * 1024 * 1024}",
+        f"PRAGMA temp_store = {profile['temp_store']}",
+    ]
+
+def make_engine(url, db_cfg=None):
+    """Engine for url with the pool and SQLite settings from config.json "database"."""
+    db_cfg = db_cfg or {}
+    kwargs = {}
+    in_memory = url == "sqlite://" or ":memory:" in url
+    if not in_memory:
+        # One connection per worker thread of the FastAPI threadpool, plus
+        # the write-behind queue and background jobs
+        kwargs.update(
+            pool_size=db_cfg.get("pool_size", 10),
+            max_overflow=db_cfg.get("max_overflow", 20),
+            pool_timeout=db_cfg.get("pool_timeout_seconds", 30),
+        )
+    if not url.startswith("sqlite"):
+        return create_engine(url, **kwargs)
+
+    sqlite_cfg = db_cfg.get("sqlite", {})
+    # auto_vacuum only takes effect on a file without tables and has to come
+    # before journal_mode, which writes the header. retention.py relies on it
+    # to hand freed pages back in small steps.
+    pragmas = ["PRAGMA auto_vacuum = INCREMENTAL"]
+    if sqlite_cfg.get("enabled", True):
+        pragmas += sqlite_pragmas(sqlite_cfg)
+    engine = create_engine(url, connect_args={"check_same_thread": False}, **kwargs)
+
+    @event.listens_for(engine, "connect")
+    def apply_profile(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return engine
 
+# Nothing touches the database at import time: the engine is created on the
+# first get_engine() call and the schema by init_db(), which app.py runs once
+# in its lifespan. Code that only needs the models or the codec never opens
+# a connection.
+_engine = None
+_engine_lock = threading.Lock()
+_schema_ready = False
 
+# Bound to the engine by get_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
-# current_db_host = engine.url.host
-# print(current_db_host)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Commit latency of every SessionLocal session, pending flush included
+@event.listens_for(SessionLocal, "before_commit")
+def _commit_started(session):
+    session.info["commit_started"] = time.perf_counter()
+
+@event.listens_for(SessionLocal, "after_commit")
+def _commit_finished(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = make_engine(get_database_url(), load_config().get("database", {}))
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+def init_db():
+    """Create the engine and any missing tables/indexes, once per process."""
+    global _schema_ready
+    engine = get_engine()
+    with _engine_lock:
+        if not _schema_ready:
+            create_schema(engine)
+            _schema_ready = True
+    return engine
 
 Base = declarative_base()
 
@@ -71,7 +157,7 @@ class DeviceReading(Base):
     __tablename__ = "readings"
     id = Column(Integer, primary_key=True, index=True)
     # timestamp = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
-    timestamp = Column(DateTime(timezone=True), server_default=datetime.now(timezone.utc).isoformat())
+    timestamp = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=datetime.now(timezone.utc).isoformat())
     network_address = Column(Integer)
     dust_concentration = Column(Float)
     pcb_temp = Column(Float)
@@ -79,12 +165,129 @@ class DeviceReading(Base):
     laser_diode_signal = Column(Integer)
     photo_diode_signal = Column(Integer)
 
+    # Every history/range query filters on one device and a time window
+    __table_args__ = (
+        Index("ix_readings_network_address_timestamp", "network_address", "timestamp"),
+    )
+
+# Pre-aggregated rollups of readings, maintained on ingest by rollups.py.
+# One row per device per bucket; mean = <field>_sum / count.
+class RollupColumns:
+    network_address = Column(Integer, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    last_timestamp = Column(DateTime)
+    dust_sum = Column(Float)
+    dust_min = Column(Float)
+    dust_max = Column(Float)
+    dust_last = Column(Float)
+    temp_sum = Column(Float)
+    temp_min = Column(Float)
+    temp_max = Column(Float)
+    temp_last = Column(Float)
+    current_sum = Column(Float)
+    current_min = Column(Float)
+    current_max = Column(Float)
+    current_last = Column(Float)
+
+class ReadingRollup1m(RollupColumns, Base):
+    __tablename__ = "readings_rollup_1m"
+    bucket_seconds = 60
+
+class ReadingRollup1h(RollupColumns, Base):
+    __tablename__ = "readings_rollup_1h"
+    bucket_seconds = 3600
+
+class ReadingRollup1d(RollupColumns, Base):
+    __tablename__ = "readings_rollup_1d"
+    bucket_seconds = 86400
+
+# Finest first
+ROLLUP_MODELS = (ReadingRollup1m, ReadingRollup1h, ReadingRollup1d)
+
+def reading_row(parsed):
+    """Map a decoded C9 response onto DeviceReading column values.
+    """
+    return {
+        "timestamp": datetime.now(timezone.utc),
+        "network_address": parsed.get("network_address"),
+        "dust_concentration": parsed.get("dust_concentration"),
+        "pcb_temp": parsed.get("pcb_temperature"),
+        "current_loop": parsed.get("current_loop"),
+        "laser_diode_signal": parsed.get("ld"),
+        "photo_diode_signal": parsed.get("pd"),
+    }
+
+def to_utc(value):
+    """Normalise a datetime to naive UTC, the form timestamps are stored in."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def utc_bound(value):
+    """A datetime as aware UTC (naive values are UTC), for binding against
+    readings.timestamp: Postgres reads a naive value for a timestamptz in the
+    session time zone. SQLite stores and compares both forms alike."""
+    if value is not None:
+        value = to_utc(value).replace(tzinfo=timezone.utc)
+    return value
+
+def encode_cursor(timestamp, reading_id):
+    return f"{to_utc(timestamp).isoformat()}_{reading_id}"
+
+def decode_cursor(cursor):
+    timestamp, reading_id = cursor.rsplit("_", 1)
+    return utc_bound(datetime.fromisoformat(timestamp)), int(reading_id)
+
+READING_COLUMNS = (
+    DeviceReading.id,
+    DeviceReading.timestamp,
+    DeviceReading.network_address,
+    DeviceReading.dust_concentration,
+    DeviceReading.pcb_temp,
+    DeviceReading.current_loop,
+    DeviceReading.laser_diode_signal,
+    DeviceReading.photo_diode_signal,
+)
+
+def query_readings(db, network_address, start=None, end=None, limit=500, cursor=None, descending=False):
+    """Readings for one device in [start, end), paged by keyset on (timestamp, id).
+
+    Served by ix_readings_network_address_timestamp, so the cost depends on
+    the page size rather than the table size. Returns (rows, next_cursor).
+    """
+    q = db.query(*READING_COLUMNS).filter(DeviceReading.network_address == network_address)
+    if start is not None:
+        q = q.filter(DeviceReading.timestamp >= utc_bound(start))
+    if end is not None:
+        q = q.filter(DeviceReading.timestamp < utc_bound(end))
+    if cursor:
+        cursor_ts, cursor_id = decode_cursor(cursor)
+        if descending:
+            q = q.filter(or_(DeviceReading.timestamp < cursor_ts,
+                             and_(DeviceReading.timestamp == cursor_ts, DeviceReading.id < cursor_id)))
+        else:
+            q = q.filter(or_(DeviceReading.timestamp > cursor_ts,
+                             and_(DeviceReading.timestamp == cursor_ts, DeviceReading.id > cursor_id)))
+    if descending:
+        q = q.order_by(DeviceReading.timestamp.desc(), DeviceReading.id.desc())
+    else:
+        q = q.order_by(DeviceReading.timestamp, DeviceReading.id)
+    rows = q.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return rows, next_cursor
+
+def create_schema(bind):
+    """Create missing tables, and missing indexes on tables that already exist."""
+    Base.metadata.create_all(bind=bind)
+    for index in DeviceReading.__table__.indexes:
+        index.create(bind=bind, checkfirst=True)
+
 def get_db():
-    db = SessionLocal()
-    # print("current_db_host", current_db_host)
-    print(f"CONNECTED TO HOST2: {engine.url.host}") 
-    print("DATABASE_URL: ", DATABASE_URL)
-    # print("DEBUG: All Env Keys:", os.environ.keys())
+    db = SessionLocal(bind=get_engine())
     try:
         yield db
     finally:
@@ -100,6 +303,3 @@ def get_db():
 #     calibration_a = Column(Float)
 #     calibration_b = Column(Float)
 #     last_updated = Column(DateTime, default=datetime.utcnow)
-
-# Create the tables
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
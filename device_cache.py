@@ -0,0 +1,88 @@
+import collections, time
+
+from sqlalchemy import select
+
+from database import ReadingRollup1d, SessionLocal, query_readings
+from live_feed import reading_event
+
+DEFAULT_RECENT_SIZE = 500
+
+
+class ReadingCache:
+    """Newest reading and a ring buffer of recent readings per network address.
+
+    Fed by the ingest flush hook with the stored rows and their ids, so the
+    current-value and recent-history endpoints never touch the database.
+    Entries have the same shape as the live feed events.
+    """
+
+    def __init__(self, size=DEFAULT_RECENT_SIZE):
+        self.size = size
+        self.latest = {}
+        self.recent = {}
+
+    def update(self, rows, ids):
+        for row, reading_id in zip(rows, ids):
+            self.add(reading_event(reading_id, row))
+
+    def add(self, event):
+        address = event["network_address"]
+        ring = self.recent.get(address)
+        if ring is None:
+            ring = self.recent[address] = collections.deque(maxlen=self.size)
+        ring.append(event)
+        self.latest[address] = event
+
+    def warm(self):
+        """Fill the ring buffers from the readings table after a restart."""
+        db = SessionLocal()
+        try:
+            # The daily rollup is the cheapest list of devices that have data
+            addresses = db.execute(select(ReadingRollup1d.network_address).distinct()).scalars().all()
+            for address in addresses:
+                rows, _ = query_readings(db, address, limit=self.size, descending=True)
+                for row in reversed(rows):
+                    self.add(reading_event(row.id, row._mapping))
+        finally:
+            db.close()
+
+    def get_latest(self, network_address=None):
+        if network_address is None:
+            return list(self.latest.values())
+        return self.latest.get(network_address)
+
+    def get_recent(self, network_address, limit=None):
+        ring = self.recent.get(network_address, ())
+        if limit is None or limit >= len(ring):
+            return list(ring)
+        return list(ring)[-limit:]
+
+
+class SystemInfoCache:
+    """Last 0x98 system-info response per serial port.
+
+    The device configuration only changes through our own set-* commands, so
+    an entry stays valid until one of those is sent on the port (or max_age
+    runs out, when set).
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.entries = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, port):
+        entry = self.entries.get(port)
+        if entry is None or (self.max_age is not None and time.monotonic() - entry[0] > self.max_age):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, port, result):
+        self.entries[port] = (time.monotonic(), result)
+
+    def invalidate(self, port):
+        if self.entries.pop(port, None) is not None:
+            self.stats["invalidations"] += 1
+
@@ -1,262 +1,418 @@
-import json, os, sys, logging, struct, serial, threading
+import os, logging, serial, threading, asyncio, time
 import serial.tools.list_ports
-from database import engine
+from concurrent.futures import ThreadPoolExecutor
+from protocol import FrameDecoder, decode_frame
+from config import load_config
+from metrics import SERIAL_ROUND_TRIP_SECONDS, STALE_FRAMES
+from serial_timing import ResponseTimer
 
 
 
 #Gloabal Variable
-serial_connection = None
+# Status of the most recent connection attempt, kept for /api/connect-device
 device_status = {"connected": False, "error": None, "port": None}
-serial_lock = threading.Lock()
+PROBE_COMMAND = "fa ff ff 98 00 00 90"
 
-if getattr(sys, 'frozen', False):
-    # If compiled, the base path is the executable's folder
-    BASE = os.path.dirname(sys.executable)
-else:
-    # If running as a script, the base path is the current file's folder
-    BASE = os.path.dirname(os.path.abspath(__file__))
+class NotConnectedError(Exception):
+    """No usable serial connection for the requested port."""
 
-CONFIG_PATH = os.path.join(BASE, "config.json")
+class UnknownPortError(ValueError):
+    """The requested port is neither an enumerated adapter nor listed in config.json."""
 
+class ResponseTimeoutError(Exception):
+    """Nothing came back from the device within the read timeout."""
 
-def load_config():
-    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
-    
-# def search_serial_ports():
-#     """Search for available serial ports."""
-#     ports = serial.tools.list_ports.comports()
-#     return [port.device for port in ports]
 
-def get_serial_connection():
-    """Establish and return a serial connection based on config.
+# Enumeration is slow on some platforms (hundreds of ms on Windows); the link
+# supervisor refreshes it in the background, request paths use the cached list
+PORT_CACHE_SECONDS = 5.0
+# An unknown port name re-enumerates at most this often, however often it is asked for
+PORT_MISS_RESCAN_SECONDS = 1.0
+_port_cache = (None, [])
+
+def search_serial_ports(max_age=PORT_CACHE_SECONDS):
+    """Search for available serial ports, reusing a list up to max_age seconds old."""
+    global _port_cache
+    checked_at, ports = _port_cache
+    if checked_at is None or time.monotonic() - checked_at >= max_age:
+        ports = [port.device for port in serial.tools.list_ports.comports()]
+        _port_cache = (time.monotonic(), ports)
+    return list(ports)
+
+def port_present(port, available):
+    """Whether the adapter behind port is plugged in. URLs are always present;
+    device paths that enumeration does not list (/dev/serial/by-id/...) count
+    while they exist."""
+    return "://" in port or port in available or os.path.exists(port)
+
+
+def url_ports_allowed():
+    """sim:// and other URL ports are for development: config.json
+    serial.allow_url_ports or ALLOW_URL_PORTS=1 in the environment."""
+    return os.environ.get("ALLOW_URL_PORTS") == "1" or bool(load_config().get("serial", {}).get("allow_url_ports"))
+
+def open_connection(port, **settings):
+    """Open a port name or URL: sim:// is the in-process device simulator, other
+    URLs (loop://, socket://, rfc2217://) go through pyserial's serial_for_url.
+    URLs only when url_ports_allowed()."""
+    if "://" in port and not url_ports_allowed():
+        raise UnknownPortError(f"URL ports are disabled, set serial.allow_url_ports to use {port!r}")
+    if port.startswith("sim://"):
+        import device_simulator  # only loaded when a simulated bus is used
+        return device_simulator.SimulatedSerial(port, **settings)
+    if "://" in port:
+        return serial.serial_for_url(port, **settings)
+    return serial.Serial(port=port, **settings)
+
+# Called with a copy of SerialPort.status whenever a port connects, drops or
+# changes error, from whichever thread noticed (see link_supervisor.py)
+state_listeners = []
+
+class SerialPort:
+    """One serial adapter: its connection, its lock and its own I/O worker
+    thread. Buses on different adapters are therefore driven in parallel while
+    traffic on a single bus stays strictly sequential.
+
+    Once connected the port is wanted until close(). If the link then breaks
+    and a supervisor watches the port (supervised), commands fail fast with
+    NotConnectedError and only the supervisor probes for the device again.
     """
-    global serial_connection
-    if serial_connection is None or not serial_connection.is_open:
-        #print("Creating fresh connection...")
+
+    # Set on the class by LinkSupervisor while it runs
+    supervised = False
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"serial-io-{port}")
+        self.status = {"connected": False, "error": None, "port": port, "state": "disconnected"}
+        self.wanted = False
+        self.failures = 0  # reconnect attempts failed in a row
+        self.retry_at = 0.0
+        # Persistent across commands so a frame split over reads is never lost
+        self.decoder = FrameDecoder()
+        # Per-device read timeouts and back-off, see serial_timing.py
+        self.timing = ResponseTimer.from_config(load_config().get("serial", {}))
+
+    def _set_status(self, connected, error=None):
+        state = "connected" if connected else "down" if self.wanted else "disconnected"
+        changed = (state, error) != (self.status.get("state"), self.status.get("error"))
+        self.status = {"connected": connected, "error": error, "port": self.port if connected else None, "state": state}
+        device_status.update(self.status)
+        if changed:
+            for listener in state_listeners:
+                listener({**self.status, "port": self.port})
+
+    def connect(self):
+        """Open the port if needed and probe it with the system-info command."""
+        if self.connection is not None and self.connection.is_open:
+            return self.connection
         try:
-            ports = serial.tools.list_ports.comports()
-            if len(ports) == 0:
-                #print("K1..")
-                device_status = {"connected": False, "error": "No serial ports found", "port": None}
-                return None
-            elif len(ports) == 1:
-                #print("K2..")
-                port = ports[0].device
-                # #print(f"Using the only available port: {port}")
-                # #print("Manufacturer:", ports[0].manufacturer)
-                # #print("Description:", ports[0].description)
-                # #print("HWID:", ports[0].hwid)
-                # #print("VID:", ports[0].vid)
-                # #print("PID:", ports[0].pid)
-                # #print("Serial Number:", ports[0].serial_number)
-                # #print("Location:", ports[0].location)
-                # #print("Product:", ports[0].product)
-                # #print("Interface:", ports[0].interface)
-                # #print("---------------------------------------------------")
-            
             cfg = load_config()
-            # port = cfg.get("serial", {}).get("port", "COM6")
             baud = cfg.get("serial", {}).get("baudrate", 9600)
             parity = cfg.get("serial", {}).get("parity", serial.PARITY_NONE)
             bytesize = cfg.get("serial", {}).get("bytesize", 8)
-            #print("port:", port)
-            serial_connection = serial.Serial(port=port, baudrate=baud, parity=parity, bytesize= bytesize, timeout=1)
-            command_hex = "fa ff ff 98 00 00 90"
-            cmd_bytes = bytes.fromhex(command_hex.replace(" ", ""))
-            btye_write = serial_connection.write(cmd_bytes)
-            #print('byte_write', btye_write)
-            first_byte = serial_connection.read(1)
-            #print('first_byte', first_byte)
+            connection = open_connection(self.port, baudrate=baud, parity=parity, bytesize=bytesize, timeout=self.timing.max_timeout)
+            connection.write(bytes.fromhex(PROBE_COMMAND.replace(" ", "")))
+            first_byte = connection.read(1)
             if first_byte == b'\xFA':
-                #print("First bit received..")
-                device_status = {"connected": True, "error": None, "port": port}
-                return serial_connection
-            else:
-                #print("No First bit received..")
-                serial_connection = None
-                device_status = {"connected": False, "error": "Device Not Connected", "port": None}
-                return None
+                # The rest of the probe response is picked up by the decoder later
+                self.decoder.reset()
+                self.decoder.feed(first_byte)
+                self.connection = connection
+                self.wanted = True
+                self.failures = 0
+                self._set_status(True)
+                return connection
+            connection.close()
+            self._set_status(False, "Device Not Connected")
+            return None
         except Exception as e:
-            device_status = {"connected": False, "error": str(e), "port": None}
-            #print('K4..', device_status)
+            self._set_status(False, str(e))
             return None
-    
-    return serial_connection 
 
-def close_serial_port():
-    if serial_connection:
-        serial_connection.close()
-        return {"Status": "Closed"}
+    def close(self):
+        with self.lock:
+            self.wanted = False
+            if self.connection:
+                self.connection.close()
+            self.connection = None
+            self._set_status(False)
+
+    def reconnect(self):
+        """One reconnect attempt, run by the supervisor on the I/O thread."""
+        with self.lock:
+            return self.connect() is not None
+
+    def mark_lost(self, error):
+        with self.lock:
+            self._link_lost(error)
+
+    def _link_lost(self, error):
+        # Caller holds the lock
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+        self.decoder.reset()
+        self._set_status(False, error)
+
+    def transact(self, cmd_bytes, timeout=None):
+        """Send a command frame and return the matching response frame as bytes.
+        Without an explicit timeout the read timeout comes from self.timing."""
+        with self.lock:
+            if self.connection is None and self.wanted and self.supervised:
+                raise NotConnectedError(f"Serial link on {self.port} is down, reconnecting ({self.status['error']})")
+            ser = self.connect()
+            if ser is None:
+                discard_serial_port(self)
+                raise NotConnectedError("No connection Established")
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                # Frames left over from earlier (timed out) commands are dropped,
+                # partial data stays in the decoder instead of flushing the port
+                if ser.in_waiting:
+                    self.decoder.feed(ser.read(ser.in_waiting))
+                bytes_sent = ser.write(cmd_bytes)
+                if bytes_sent != len(cmd_bytes): 
+                    logging.warning("Sent %d bytes, expected %d", bytes_sent, len(cmd_bytes))   
+                frame = self._read_response(ser, cmd_bytes, self.timing.timeout(cmd_bytes) if timeout is None else timeout)
+                outcome = "ok"
+                self.timing.record_response(cmd_bytes, time.perf_counter() - start)
+                return frame
+            except Exception as e:
+                if isinstance(e, OSError):
+                    # SerialException included: the adapter is gone, not the device
+                    self._link_lost(str(e))
+                elif outcome != "ok":
+                    self.timing.record_failure(cmd_bytes, timed_out=isinstance(e, ResponseTimeoutError))
+                raise Exception(f"Serial communication error: {str(e)}")
+            finally:
+                SERIAL_ROUND_TRIP_SECONDS.observe(time.perf_counter() - start, f"{cmd_bytes[3]:02X}", outcome)
+
+    @staticmethod
+    def _matches(frame, cmd_bytes):
+        """Reply to cmd_bytes: same command byte, and from the addressed device
+        unless the command went to broadcast 0xFFFF."""
+        return frame[4] == cmd_bytes[3] and (cmd_bytes[1:3] == b"\xff\xff" or frame[2:4] == cmd_bytes[1:3])
+
+    def _read_response(self, ser, cmd_bytes, timeout):
+        # Assigning ser.timeout reconfigures the port (tcsetattr / SetCommTimeouts),
+        # so it is set once per transaction and each read asks for the rest of
+        # the frame: the header, then everything up to the end byte.
+        if ser.timeout != timeout:
+            ser.timeout = timeout
+        deadline = time.monotonic() + timeout
+        received = False
+        while True:
+            chunk = ser.read(max(ser.in_waiting, self.decoder.needed()))
+            received = received or bool(chunk)
+            for frame in self.decoder.feed(chunk):
+                if self._matches(frame, cmd_bytes):
+                    return frame
+                self._stale(frame)
+            if not chunk or time.monotonic() >= deadline:
+                self.decoder.resync()
+                # Dropping a bad head can expose a reply that is already buffered
+                for frame in self.decoder.feed(b""):
+                    if self._matches(frame, cmd_bytes):
+                        return frame
+                    self._stale(frame)
+                if received:
+                    raise Exception("Incomplete or invalid response from device")
+                raise ResponseTimeoutError(f"No response from device within {timeout * 1000:.0f} ms")
+
+    def _stale(self, frame):
+        # A late reply to an earlier command, possibly from another device on the bus
+        STALE_FRAMES.inc(f"{frame[4]:02X}")
+        logging.debug("Dropping stale %02x frame from %d on %s", frame[4], frame[2] << 8 | frame[3], self.port)
+
+
+# One SerialPort per adapter, keyed by port name (COM3, /dev/ttyUSB0, ...)
+serial_ports = {}
+serial_ports_lock = threading.Lock()
+
+def configured_ports(cfg=None):
+    """Port names config.json refers to: serial.port, serial.ports and the scheduler roster."""
+    cfg = cfg or load_config()
+    names = [cfg.get("serial", {}).get("port")] + list(cfg.get("serial", {}).get("ports", []))
+    names += [entry.get("port") for entry in cfg.get("scheduler", {}).get("roster", [])]
+    return {name for name in names if name}
+
+def check_port(port):
+    """Raise UnknownPortError unless port is an enumerated adapter or configured.
+    Request parameters name ports, so nothing else may be opened."""
+    if "://" in port:
+        if url_ports_allowed():
+            return port
+        raise UnknownPortError(f"URL ports are disabled, set serial.allow_url_ports to use {port!r}")
+    if port in configured_ports() or port in search_serial_ports():
+        return port
+    # Maybe plugged in since the cached enumeration
+    if port in search_serial_ports(PORT_MISS_RESCAN_SECONDS):
+        return port
+    raise UnknownPortError(f"Unknown serial port {port!r}")
+
+def resolve_port(port=None):
+    """Pick the port to talk to: the requested one, the configured default, or
+    the only enumerated adapter. With several adapters the caller must choose.
+    """
+    if port:
+        return check_port(port)
+    configured = load_config().get("serial", {}).get("port")
+    if configured:
+        return configured
+    ports = search_serial_ports()
+    if len(ports) == 0:
+        raise NotConnectedError("No serial ports found")
+    if len(ports) > 1:
+        raise NotConnectedError(f"Multiple serial ports found ({', '.join(ports)}), specify a port")
+    return ports[0]
+
+def get_serial_port(port=None):
+    """Return the SerialPort manager for port, creating it on first use."""
+    # Registered ports passed check_port when they were created
+    serial_port = serial_ports.get(port) if port else None
+    if serial_port is not None:
+        return serial_port
+    name = resolve_port(port)
+    with serial_ports_lock:
+        if name not in serial_ports:
+            serial_ports[name] = SerialPort(name)
+        return serial_ports[name]
+
+async def resolve_port_async(port=None):
+    """resolve_port for the event loop. Registered ports need no lookup;
+    anything else may enumerate adapters, which runs on a thread."""
+    name = port or load_config().get("serial", {}).get("port")
+    if name and name in serial_ports:
+        return name
+    return await asyncio.to_thread(resolve_port, port)
+
+async def get_serial_port_async(port=None):
+    """get_serial_port for the event loop, see resolve_port_async."""
+    name = await resolve_port_async(port)
+    return serial_ports.get(name) or await asyncio.to_thread(get_serial_port, name)
+
+def discard_serial_port(serial_port):
+    """Forget a port that never opened, so failed names do not pile up
+    entries and worker threads. Ports that were connected stay for the supervisor."""
+    with serial_ports_lock:
+        if serial_port.wanted or serial_ports.get(serial_port.port) is not serial_port:
+            return
+        del serial_ports[serial_port.port]
+    serial_port.executor.shutdown(wait=False)
+
+def get_serial_connection(port=None):
+    """Establish and return a serial connection based on config.
+    """
+    try:
+        serial_port = get_serial_port(port)
+    except Exception as e:
+        device_status.update({"connected": False, "error": str(e), "port": None})
+        return None
+    with serial_port.lock:
+        connection = serial_port.connect()
+    if connection is None:
+        discard_serial_port(serial_port)
+    return connection
+
+def close_serial_port(port=None):
+    targets = [serial_ports[port]] if port in serial_ports else list(serial_ports.values()) if port is None else []
+    for serial_port in targets:
+        serial_port.close()
     return {"Status": "Closed"}
 
-def send_and_receive(command_hex: str) -> str:
+def parse_command(command_hex: str) -> bytes:
+    cmd_bytes = bytes.fromhex(command_hex.replace(" ", ""))
+    if len(cmd_bytes) < 7:
+        raise Exception("Command too short")
+    if len(cmd_bytes) > 7:
+        raise Exception("Command too long")
+    if cmd_bytes[0] != 0xFA:
+        raise Exception("Invalid start byte in command")
+    return cmd_bytes
+
+def transact(cmd_bytes: bytes, timeout: float = None, port: str = None) -> bytes:
+    """Send a command frame (bytes) and return the response frame (bytes).
+    timeout overrides the serial read timeout for this command only, port
+    selects the adapter (see resolve_port).
+    """
+    return get_serial_port(port).transact(cmd_bytes, timeout)
+
+async def transact_async(cmd_bytes: bytes, timeout: float = None, wait_timeout: float = 10.0, port: str = None,
+                         backoff: bool = False) -> bytes:
+    """Awaitable transact. The blocking serial I/O runs on the worker thread of
+    the selected port so the event loop stays responsive while the bus is
+    busy. timeout overrides the adaptive device read timeout, wait_timeout
+    bounds the time spent queued behind other commands on the same port.
+    backoff=True (periodic polls) raises DeviceBackoffError right away for a
+    device that keeps timing out, instead of spending bus time on it.
+    """
+    serial_port = await get_serial_port_async(port)
+    if backoff:
+        serial_port.timing.check_backoff(cmd_bytes)
+    loop = asyncio.get_running_loop()
+    read_timeout = serial_port.timing.max_timeout if timeout is None else timeout
+    try:
+        future = loop.run_in_executor(serial_port.executor, serial_port.transact, cmd_bytes, timeout)
+    except RuntimeError:
+        # Discarded by a concurrent failed open
+        raise NotConnectedError("No connection Established")
+    try:
+        return await asyncio.wait_for(future, wait_timeout + read_timeout)
+    except asyncio.TimeoutError:
+        raise Exception(f"Serial communication error: command timed out after {wait_timeout + read_timeout:.1f}s")
+
+def send_and_receive(command_hex: str, timeout: float = None, port: str = None) -> str:
     """Send a hex command (string) to device and return hex response string.
+    Hex wrapper around transact, kept for callers that work with hex strings.
     """
-    #print("command_hex:", command_hex)
-    # Convert hex string to bytes
     try:
-        cmd_bytes = bytes.fromhex(command_hex.replace(" ", ""))
-        #print('cmd_bytes --> ', cmd_bytes)
-        if len(cmd_bytes) < 7:
-            raise Exception("Command too short")
-        if len(cmd_bytes) > 7:
-            raise Exception("Command too long")
-        if len(cmd_bytes) != 7:
-            raise Exception("Command should be 7 bytes")
-        if cmd_bytes[0] != 0xFA:
-            raise Exception("Invalid start byte in command")
-        
+        cmd_bytes = parse_command(command_hex)
     except Exception as e:
         return f"Error: invalid command hex - {str(e)}"
+    try:
+        return transact(cmd_bytes, timeout, port).hex()
+    except NotConnectedError as e:
+        return {"error": str(e)}
 
-    # Can be removed If centralized serial connection logic works.
-    # cfg = load_config()
-    # port = cfg.get("serial", {}).get("port", "COM6")
-    # baud = cfg.get("serial", {}).get("baudrate", 9600)
-    # parity = cfg.get("serial", {}).get("parity", "N")
-    # bytesize = cfg.get("serial", {}).get("bytesize", 8)
-    
-    with serial_lock:
-        ser = get_serial_connection()
-        if ser is not None:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-        else:
-            return {"error":"No connection Established"}
-        try:
-            # #print("ser.port:", ser.port)
-            # #print("ser.baudrate:", ser.baudrate)
-            # #print("ser.parity:", ser.parity)
-            # #print("ser.bytesize:", ser.bytesize)
-            # #print("ser.timeout:", ser.timeout)
-            # #print("Sending command...")
-
-            # #print("First byte even before reading:",ser.read(1))  
-
-            bytes_sent = ser.write(cmd_bytes)
-            #print("bytes_sent:", bytes_sent)
-            if bytes_sent != len(cmd_bytes): 
-                logging.warning("Sent %d bytes, expected %d", bytes_sent, len(cmd_bytes))   
-            
-            resp = ser.read(1) # read first byte to check the start byte
-            #print("resp first byte:", resp)
-            if not resp: 
-                #print("No response from device")
-                raise Exception("No response from device")
-            if resp != b'\xFA':
-                #print("Invalid start byte in response")
-                raise Exception("Invalid start byte")
-            
-            second_byte = ser.read(1) # Read 2nd byte, indicates number of bytes contained in this packet
-            #print("second_byte:", second_byte)
-            if not second_byte:
-                raise Exception("Incomplete response from device. Second byte missing in response.")
-            resp += second_byte
-            packet_length = int.from_bytes(second_byte, "big") # More reliable but below one is faster
-            # packet_length = second_byte[0]
-            #print("packet_length:", packet_length)
-            resp += ser.read(packet_length - 2) # read the rest of the packet
-            #print("*************resp.hex()************\n", resp.hex())
-            return resp.hex()
-        except Exception as e:
-                    #need to remove this later
-            import traceback
-            error_details = traceback.format_exc()
-            #print(f"DEBUG LOG:\n{error_details}")
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = exc_tb.tb_frame.f_code.co_filename
-            line_no = exc_tb.tb_lineno
-            #print(f"Error: {exc_type.__name__} in {fname} at line {line_no}: {str(e)}")
-            raise Exception(f"Serial communication error: {str(e)}")
+async def send_and_receive_async(command_hex: str, timeout: float = None, wait_timeout: float = 10.0, port: str = None) -> str:
+    """Hex wrapper around transact_async."""
+    try:
+        cmd_bytes = parse_command(command_hex)
+    except Exception as e:
+        return f"Error: invalid command hex - {str(e)}"
+    try:
+        return (await transact_async(cmd_bytes, timeout, wait_timeout, port)).hex()
+    except NotConnectedError as e:
+        return {"error": str(e)}
+
+async def get_serial_connection_async(port=None):
+    """Open (or reuse) a serial connection from that port's worker thread."""
+    try:
+        serial_port = await get_serial_port_async(port)
+    except Exception as e:
+        device_status.update({"connected": False, "error": str(e), "port": None})
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(serial_port.executor, get_serial_connection, serial_port.port)
+    except RuntimeError:
+        # Discarded by a concurrent failed open, the next attempt starts afresh
+        return None
 
 
 def decode_response(hexstr: str) -> dict:
     """Decode Bytes response into sensor fields.
-    Returns a dict with interpreted values.
+    Returns a dict with interpreted values. Hex wrapper around protocol.decode_frame.
     """
-    # #print("***************hexstr*****************", hexstr)
     try:
         b = bytes.fromhex(hexstr)
-        # #print("***************bytes*****************", b)
-        if len(b) >= 2 and b[0] != 0xFA:
-            return {"error": "invalid start byte in Response"}
-        if len(b) >= 2 and b[-1] != 0xF5:
-            return {"error": "invalid end byte in Response"}
     except Exception:
         return {"error": "invalid hex"}
-    decoded_resp = {}
-    cmdId = b[4]
-    # #print("****************cmdId****************", cmdId)
-    if cmdId == 0xC9:
-        #print("My News---->",engine.url.host) #KIDEL
-        if len(b) < 39:
-            #print(f"!!! CRITICAL: Received short packet ({len(b)} bytes). Skipping decode.")
-            return {"error": "incomplete response for command C9"}
-        
-        calculated_checksum = sum(b[:-2]) % 0x100
-        if calculated_checksum != b[-2]:
-            #print("****************calculated_checksum****************", calculated_checksum, b[-1])
-            #print("!!! CRITICAL: Checksum mismatch. Data is corrupted.")
-            return {"error": "Checksum failed"}
-        
-        decoded_resp["network_address"] = int.from_bytes(b[2:4], "big")
-        decoded_resp["ld"] = int.from_bytes(b[5:7], "big")
-        decoded_resp["pd"] = int.from_bytes(b[7:9], "big")
-        decoded_resp["pcb_temperature"] = round(25 - (int.from_bytes(b[19:21], "big") - 1065) * 1025 / 4096, 2)
-        decoded_resp["dust_concentration"] = round(struct.unpack(">f", b[25:29])[0], 2)
-        decoded_resp["current_loop"] = int.from_bytes(b[33:35], "big") / 100
-        #print("***********************decode_response:************************ \n", decoded_resp)
-    elif cmdId == 0x98:
-        decoded_resp["network_address_info"] = int.from_bytes(b[2:4], "big")
-        decoded_resp["calibration_factor"] = round(struct.unpack(">f", b[5:9])[0], 3)
-        #print("calibration_factor:", decoded_resp["calibration_factor"])
-        if decoded_resp["calibration_factor"] > 10:
-            decoded_resp["calibration_a"] = 10.0
-        elif decoded_resp["calibration_factor"] < 10:
-            decoded_resp["calibration_a"] = decoded_resp["calibration_factor"]
-        #print("calibration_a:", decoded_resp["calibration_a"])
-        decoded_resp["range"] = int.from_bytes(b[9:11], "big")
-        decoded_resp["calibration_b"] = round(struct.unpack(">f", b[11:15])[0], 3)
-        decoded_resp["smoothing_time_sec"] = struct.unpack(">f", b[41:45])[0] #int.from_bytes(b[41:45], "big")
-        decoded_resp["temp_auth_days"] = int.from_bytes(b[49:51], "big")
-        decoded_resp["TimeUserHours"] = int.from_bytes(b[51:53], "big")
-        decoded_resp["MSN"] = int.from_bytes(b[55:57], "big")
-        decoded_resp["alarm_threshold"] = int.from_bytes(b[59:61], "big")
-        
-    elif cmdId == 0x97:
-        decoded_resp["set_network_address_ack"] = "Success"
-        decoded_resp["new_network_address"] = int.from_bytes(b[2:4], "big")
-        
-    elif cmdId == 0x8C:
-        decoded_resp["set_smoothing_time_ack"] = "Success"
-        decoded_resp["new_smoothing_time_sec"] = struct.unpack(">f", b[5:9])[0]
-        
-    elif cmdId == 0x9D:
-        decoded_resp["set_range_ack"] = "Success"
-        decoded_resp["new_range"] = int.from_bytes(b[5:7], "big")
-        
-    elif cmdId == 0x9A:
-        decoded_resp["set_alarm_ack"] = "Success"
-        decoded_resp["new_alarm_threshold"] = int.from_bytes(b[5:7], "big")
-        
-    elif cmdId == 0xCF:
-        decoded_resp["set_calibration_a_ack"] = "Success"
-        decoded_resp["new_calibration_a"] = struct.unpack(">f", b[5:9])[0]
-    elif cmdId == 0xD0:
-        decoded_resp["set_calibration_b_ack"] = "Success"
-        decoded_resp["new_calibration_b"] = struct.unpack(">f", b[5:9])[0]
-    elif cmdId == 0x9E:
-        decoded_resp["set_correction_value_ack"] = "Success"
-        decoded_resp["new_correction_value"] = round(struct.unpack(">f", b[5:9])[0], 3)
-    elif cmdId == 0xA5:
-        decoded_resp["set_cancel_correction_ack"] = "Success"
-        decoded_resp["cancel_correction_value"] = 1.0
-    elif cmdId == 0xD1:
-        decoded_resp["set_zero_calibration_ack"] = "Success"
-    elif cmdId == 0xD2:
-        decoded_resp["cancel_zero_calibration_ack"] = "Success"
-    elif cmdId == 0xD3:
-        decoded_resp["set_range_calibration_ack"] = "Success"
-    #print("***********************decode_response:************************\n", decoded_resp)
-    return decoded_resp
+    return decode_frame(b)
@@ -0,0 +1,295 @@
+"""Software dust sensor bus for load and latency testing without hardware.
+
+Answers the same commands as the real sensors (C9 readings, 98 system info
+and the set-* acks) for any number of network addresses, with serial
+transfer time from the baud rate plus optional jitter, dropped and
+corrupted responses. Two ways to plug it in:
+
+    sim://?addresses=16,17&baud=9600&jitter_ms=2&drop=0.01&corrupt=0.01&seed=1
+        as the port name (config.json serial.port or ?port=), served
+        in-process by SimulatedSerial; needs serial.allow_url_ports or
+        ALLOW_URL_PORTS=1
+
+    python device_simulator.py --pty --addresses 16,17 [--baud ...]
+        a pseudo-terminal pair; prints the /dev/pts path to use as the port
+"""
+import argparse, collections, os, random, struct, time
+from urllib.parse import parse_qs, urlparse
+
+from protocol import (C9_FRAME, FRAME_END, FRAME_START, SYSTEM_INFO_FRAME, frame_checksum)
+
+BROADCAST = 0xFFFF
+COMMAND_LENGTH = 7
+ACK_LENGTH = 11
+FLOAT_AT_5 = struct.Struct(">f")
+UINT16 = struct.Struct(">H")
+
+
+def build_frame(network_address, cmd, length, payload=None, layout=None):
+    """Response frame with header, trailer and checksum filled in."""
+    frame = bytearray(length)
+    if layout is not None:
+        layout.pack_into(frame, 0, *payload)
+    frame[0], frame[1], frame[4], frame[-1] = FRAME_START, length, cmd, FRAME_END
+    frame[2:4] = UINT16.pack(network_address & 0xFFFF)
+    frame[-2] = frame_checksum(frame)
+    return bytes(frame)
+
+
+class SimulatedDevice:
+    """State of one sensor: its settings and a random-walk dust level."""
+
+    def __init__(self, network_address, rng):
+        self.network_address = network_address
+        self.rng = rng
+        self.dust = rng.uniform(5, 50)
+        self.range = 1000
+        self.alarm_threshold = 800
+        self.smoothing_time = 10.0
+        self.calibration_a = 1.0
+        self.calibration_b = 0.0
+        self.correction = 1.0
+        self.msn = 1000 + network_address
+
+    def reading(self):
+        self.dust = max(0.0, self.dust + self.rng.gauss(0, 0.5))
+        temp_raw = 1065 + int(self.rng.gauss(0, 4))
+        current = int(400 + 1600 * min(self.dust, self.range) / self.range)  # 4-20 mA in 1/100 mA
+        payload = (self.network_address, self.rng.randint(900, 1100), self.rng.randint(1900, 2100),
+                   temp_raw, self.dust, current)
+        return build_frame(self.network_address, 0xC9, C9_FRAME.size, payload, C9_FRAME)
+
+    def system_info(self):
+        payload = (self.network_address, self.calibration_a, self.range, self.calibration_b,
+                   self.smoothing_time, 365, 1200, self.msn, self.alarm_threshold)
+        return build_frame(self.network_address, 0x98, SYSTEM_INFO_FRAME.size + 2, payload, SYSTEM_INFO_FRAME)
+
+    def ack(self, cmd, value=None):
+        frame = bytearray(build_frame(self.network_address, cmd, ACK_LENGTH))
+        if value is not None:
+            layout = FLOAT_AT_5 if isinstance(value, float) else UINT16
+            layout.pack_into(frame, 5, value)
+            frame[-2] = frame_checksum(frame)
+        return bytes(frame)
+
+    def handle(self, cmd, value):
+        if cmd == 0xC9:
+            return self.reading()
+        if cmd == 0x98:
+            return self.system_info()
+        if cmd == 0x97:
+            self.network_address = value
+            return self.ack(cmd)
+        if cmd == 0x8C:
+            self.smoothing_time = float(value)
+            return self.ack(cmd, self.smoothing_time)
+        if cmd == 0x9D:
+            self.range = value
+            return self.ack(cmd, value)
+        if cmd == 0x9A:
+            self.alarm_threshold = value
+            return self.ack(cmd, value)
+        if cmd == 0xCF:
+            self.calibration_a = value / 1000
+            return self.ack(cmd, self.calibration_a)
+        if cmd == 0xD0:
+            self.calibration_b = value / 10
+            return self.ack(cmd, self.calibration_b)
+        if cmd == 0x9E:
+            self.correction = float(value)
+            return self.ack(cmd, self.correction)
+        if cmd == 0xA5:
+            self.correction = 1.0
+            return self.ack(cmd)
+        if cmd in (0xD1, 0xD2, 0xD3):
+            return self.ack(cmd)
+        return None  # unknown commands go unanswered, as on the real bus
+
+
+class SimulatedBus:
+    """A multi-drop bus of SimulatedDevices behind one serial line."""
+
+    def __init__(self, addresses=(16,), baudrate=9600, jitter=0.0, drop_rate=0.0, corrupt_rate=0.0,
+                 processing=0.002, seed=None):
+        self.rng = random.Random(seed)
+        self.devices = [SimulatedDevice(address, self.rng) for address in addresses]
+        self.baudrate = baudrate
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.processing = processing
+        self.stats = {"commands": 0, "responses": 0, "dropped": 0, "corrupted": 0, "ignored": 0}
+
+    @classmethod
+    def from_url(cls, url):
+        """sim://?addresses=16,17&baud=9600&jitter_ms=2&drop=0.01&corrupt=0.01&seed=1"""
+        query = {key: values[-1] for key, values in parse_qs(urlparse(url).query).items()}
+        return cls(
+            addresses=[int(a, 0) for a in query.get("addresses", "16").split(",")],
+            baudrate=int(query.get("baud", 9600)),
+            jitter=float(query.get("jitter_ms", 0)) / 1000,
+            drop_rate=float(query.get("drop", 0)),
+            corrupt_rate=float(query.get("corrupt", 0)),
+            processing=float(query.get("processing_ms", 2)) / 1000,
+            seed=int(query["seed"]) if "seed" in query else None,
+        )
+
+    def transfer_time(self, nbytes):
+        return nbytes * 10 / self.baudrate  # start + 8 data + stop bits
+
+    def handle(self, command):
+        """Answer one 7-byte command: (delay in seconds, response bytes or None)."""
+        self.stats["commands"] += 1
+        if len(command) != COMMAND_LENGTH or command[0] != FRAME_START or sum(command[:-1]) % 0x100 != command[-1]:
+            self.stats["ignored"] += 1
+            return 0.0, None
+        address, cmd, value = UINT16.unpack_from(command, 1)[0], command[3], UINT16.unpack_from(command, 4)[0]
+        if address == BROADCAST:
+            device = self.devices[0] if self.devices else None
+        else:
+            device = next((d for d in self.devices if d.network_address == address), None)
+        response = device.handle(cmd, value) if device is not None else None
+        if response is None:
+            self.stats["ignored"] += 1
+            return 0.0, None
+        if self.rng.random() < self.drop_rate:
+            self.stats["dropped"] += 1
+            return 0.0, None
+        if self.rng.random() < self.corrupt_rate:
+            self.stats["corrupted"] += 1
+            response = bytearray(response)
+            response[self.rng.randrange(1, len(response) - 1)] ^= 1 << self.rng.randrange(8)
+            response = bytes(response)
+        self.stats["responses"] += 1
+        delay = self.transfer_time(COMMAND_LENGTH + len(response)) + self.processing
+        if self.jitter:
+            delay += self.rng.uniform(0, self.jitter)
+        return delay, response
+
+
+def split_commands(buffer):
+    """Pop complete 7-byte commands off the front of a bytearray."""
+    commands = []
+    while True:
+        start = buffer.find(FRAME_START)
+        if start < 0:
+            buffer.clear()
+            return commands
+        del buffer[:start]
+        if len(buffer) < COMMAND_LENGTH:
+            return commands
+        commands.append(bytes(buffer[:COMMAND_LENGTH]))
+        del buffer[:COMMAND_LENGTH]
+
+
+class SimulatedSerial:
+    """Just enough of serial.Serial for SerialPort, backed by a SimulatedBus.
+
+    Responses become readable once their transfer time has passed, and reads
+    honour timeout like a real port.
+    """
+
+    def __init__(self, url, timeout=1.0, **kwargs):
+        self.port = url
+        self.bus = SimulatedBus.from_url(url)
+        self.timeout = timeout
+        self.is_open = True
+        self._pending = collections.deque()  # (ready_at, bytes)
+        self._buffer = bytearray()
+        self._commands = bytearray()
+        self._busy_until = 0.0
+
+    def _release(self):
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            self._buffer += self._pending.popleft()[1]
+
+    @property
+    def in_waiting(self):
+        self._release()
+        return len(self._buffer)
+
+    def write(self, data):
+        self._commands += data
+        for command in split_commands(self._commands):
+            delay, response = self.bus.handle(command)
+            if response is not None:
+                # One conversation at a time on the line
+                ready_at = max(time.monotonic(), self._busy_until) + delay
+                self._busy_until = ready_at
+                self._pending.append((ready_at, response))
+        return len(data)
+
+    def read(self, size=1):
+        # Like pyserial: size bytes, or fewer once the timeout has passed
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            self._release()
+            now = time.monotonic()
+            if len(self._buffer) >= size or (deadline is not None and now >= deadline):
+                data = bytes(self._buffer[:size])
+                del self._buffer[:size]
+                return data
+            wake = self._pending[0][0] if self._pending else deadline
+            if wake is None:
+                data = bytes(self._buffer[:size])  # nothing more will arrive and no timeout to wait out
+                del self._buffer[:size]
+                return data
+            if deadline is not None:
+                wake = min(wake, deadline)
+            time.sleep(max(0.0, wake - now))
+
+    def reset_input_buffer(self):
+        self._release()
+        self._buffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def serve_pty(bus):
+    """Serve the bus on a pseudo-terminal until interrupted."""
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print(f"Simulated bus with addresses {[d.network_address for d in bus.devices]} on {os.ttyname(slave)}", flush=True)
+    commands = bytearray()
+    try:
+        while True:
+            commands += os.read(master, 256)
+            for command in split_commands(commands):
+                delay, response = bus.handle(command)
+                if response is not None:
+                    time.sleep(delay)
+                    os.write(master, response)
+    except KeyboardInterrupt:
+        print(bus.stats)
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pty", action="store_true", help="serve on a pseudo-terminal (Linux/macOS)")
+    parser.add_argument("--addresses", default="16", help="comma separated network addresses")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--drop", type=float, default=0.0, help="fraction of responses dropped")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="fraction of responses with a flipped bit")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    if not args.pty:
+        parser.error("only --pty is served standalone, use a sim:// port for in-process simulation")
+    serve_pty(SimulatedBus(
+        addresses=[int(a, 0) for a in args.addresses.split(",")],
+        baudrate=args.baud,
+        jitter=args.jitter_ms / 1000,
+        drop_rate=args.drop,
+        corrupt_rate=args.corrupt,
+        seed=args.seed,
+    ))
@@ -0,0 +1,99 @@
+import csv, io
+
+from sqlalchemy import select
+
+from database import DeviceReading, READING_COLUMNS, get_engine, to_utc, utc_bound
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional, only needed for format=arrow
+    pa = None
+
+EXPORT_HEADER = [column.key for column in READING_COLUMNS]
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def export_query(network_address=None, start=None, end=None):
+    query = select(*READING_COLUMNS)
+    if network_address is not None:
+        query = query.where(DeviceReading.network_address == network_address)
+    if start is not None:
+        query = query.where(DeviceReading.timestamp >= utc_bound(start))
+    if end is not None:
+        query = query.where(DeviceReading.timestamp < utc_bound(end))
+    if network_address is not None:
+        # Walks ix_readings_network_address_timestamp in order
+        return query.order_by(DeviceReading.timestamp, DeviceReading.id)
+    return query.order_by(DeviceReading.id)
+
+
+def iter_reading_chunks(network_address=None, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of reading rows, chunk_size at a time.
+
+    Uses a server-side cursor (stream_results) on its own connection, so
+    only one chunk is ever held in memory and the export outlives the
+    request's session.
+    """
+    with get_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            export_query(network_address, start, end))
+        for partition in result.partitions():
+            yield partition
+
+
+def csv_chunks(network_address=None, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """CSV export as a stream of encoded chunks, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    for rows in iter_reading_chunks(network_address, start, end, chunk_size):
+        for row in rows:
+            writer.writerow((row.id, row.timestamp.isoformat(), *row[2:]))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("network_address", pa.int32()),
+        ("dust_concentration", pa.float64()),
+        ("pcb_temp", pa.float64()),
+        ("current_loop", pa.float64()),
+        ("laser_diode_signal", pa.int32()),
+        ("photo_diode_signal", pa.int32()),
+    ])
+
+
+def arrow_chunks(network_address=None, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Arrow IPC stream, one record batch per chunk. Needs pyarrow."""
+    if pa is None:
+        raise RuntimeError("Arrow export needs the optional pyarrow package")
+    schema = arrow_schema()
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    for rows in iter_reading_chunks(network_address, start, end, chunk_size):
+        columns = list(zip(*rows))
+        columns[1] = [to_utc(ts) for ts in columns[1]]
+        writer.write_batch(pa.record_batch([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                           schema=schema))
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+EXPORT_FORMATS = {
+    "csv": (csv_chunks, "text/csv", "csv"),
+    "arrow": (arrow_chunks, "application/vnd.apache.arrow.stream", "arrows"),
+}
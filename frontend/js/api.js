@@ -174,9 +174,88 @@ async function writeAndRead(hexCmd) {
 export let isReading = false;
 export async function stopReading() {
     isReading = false;
+    await flushReadings();
     // showToast("Reading stopped", "info");
 }
 
+// Continuous readings are decoded here and shown straight away; only storing them
+// is batched via /api/store-readings, flushed when the buffer is full, the oldest
+// reading has waited long enough, or the page goes away.
+const READING_BATCH_SIZE = 10;
+const READING_FLUSH_MS = 5000;
+let readingBuffer = [];
+let readingFlushTimer = null;
+
+// C9 response layout, big-endian, as protocol.py C9_FRAME
+const C9_SIZE = 39;
+const round2 = (value) => Math.round(value * 100) / 100;
+
+// Same fields as protocol.py _decode_c9, null for anything but a valid C9 frame
+function decodeC9(bytes) {
+    const length = bytes.length;
+    if (length < C9_SIZE || bytes[0] !== 0xFA || bytes[4] !== 0xC9 || bytes[length - 1] !== 0xF5) return null;
+    const checksum = bytes.subarray(0, length - 2).reduce((a, b) => a + b, 0) % 0x100;
+    if (checksum !== bytes[length - 2]) return null;
+    const view = new DataView(bytes.buffer, bytes.byteOffset, length);
+    return {
+        network_address: view.getUint16(2),
+        ld: view.getUint16(5),
+        pd: view.getUint16(7),
+        pcb_temperature: round2(25 - (view.getUint16(19) - 1065) * 1025 / 4096),
+        dust_concentration: round2(view.getFloat32(25)),
+        current_loop: view.getUint16(33) / 100,
+    };
+}
+
+function queueReading(responseHex) {
+    const parsed = decodeC9(hexToBytes(responseHex));
+    if (parsed) {
+        window.processNewData(parsed);
+    } else {
+        console.error("Invalid reading:", responseHex);
+    }
+
+    readingBuffer.push(responseHex);
+    if (readingBuffer.length >= READING_BATCH_SIZE) {
+        flushReadings();
+    } else if (!readingFlushTimer) {
+        readingFlushTimer = setTimeout(flushReadings, READING_FLUSH_MS);
+    }
+}
+
+function takeBatch() {
+    clearTimeout(readingFlushTimer);
+    readingFlushTimer = null;
+    const batch = readingBuffer;
+    readingBuffer = [];
+    return batch;
+}
+
+async function flushReadings() {
+    const batch = takeBatch();
+    if (batch.length === 0) return;
+    try {
+        const res = await fetch(`${API_BASE}/api/store-readings`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ raw_hex_list: batch })
+        });
+        if (!res.ok) {
+            console.error("Batch store failed:", res.status, await res.text());
+        }
+    } catch (err) {
+        console.error("Batch store error:", err);
+    }
+}
+
+// A fetch does not survive the tab closing, a beacon does
+window.addEventListener("pagehide", () => {
+    const batch = takeBatch();
+    if (batch.length === 0) return;
+    const body = new Blob([JSON.stringify({ raw_hex_list: batch })], { type: "application/json" });
+    navigator.sendBeacon(`${API_BASE}/api/store-readings`, body);
+});
+
 export async function readData(period_in_seconds) {
     
     if (isReading && period_in_seconds > 0) return;
@@ -200,9 +279,10 @@ export async function readData(period_in_seconds) {
     showToast(`Continuous reading started (${period_in_seconds}s interval)`, "success");
     isReading = true;
     while (isReading) {
-        const result = await executeSingleRead(hexCmd);
-        if (result && result.parsed) {
-            window.processNewData(result.parsed); 
+        try {
+            queueReading(await writeAndRead(hexCmd));
+        } catch (err) {
+            console.error("Hardware Read Error:", err);
         }
 
         await new Promise(r => setTimeout(r, period_in_seconds * 1000));
@@ -406,13 +486,36 @@ export async function updateCalibrations(type) {
     }
 }
 
-export async function fetchHistory() {
+// History of the connected device, newest `limit` readings. Pass the returned
+// next_cursor to load the page before it.
+export async function fetchHistory(limit = 50, cursor = null) {
+    const params = new URLSearchParams({ limit });
+    if (networkAddress !== null) params.set("network_address", networkAddress);
+    if (cursor) params.set("cursor", cursor);
     try {
-        const response = await fetch(`${API_BASE}/api/get-reading-history`);
+        const response = await fetch(`${API_BASE}/api/get-reading-history?${params}`);
         if (!response.ok) throw new Error("Failed to fetch history");
         return await response.json();
     } catch (err) {
         console.error("History fetch error:", err);
-        return { history: [] };
+        return { history: [], next_cursor: null };
     }
-}
\ No newline at end of file
+}
+
+// Live readings for one device over Server-Sent Events. EventSource reconnects
+// by itself and resumes from the last event id, so no readings are missed.
+export function subscribeReadings(networkAddress, onReading) {
+    const source = new EventSource(`${API_BASE}/api/readings/stream?network_address=${networkAddress}`);
+    source.addEventListener("reading", (event) => onReading(JSON.parse(event.data)));
+    source.onerror = (err) => console.error("Live feed error", err);
+    return () => source.close();
+}
+
+// Serial link state changes ({port, state: connected|down|disconnected, error}),
+// the current state of every port arrives first. Returns a function that closes the feed.
+export function subscribeLinkState(onState) {
+    const source = new EventSource(`${API_BASE}/api/serial-ports/stream`);
+    source.addEventListener("link", (event) => onState(JSON.parse(event.data)));
+    source.onerror = (err) => console.error("Link state feed error", err);
+    return () => source.close();
+}
@@ -1,24 +1,68 @@
 let socket = null;
 
+// Layout of "binary" format frames, see ws_codec.py
+const KIND_READING = 1;
+const KIND_ERROR = 2;
+const FLAG_RAW = 0x01;
+const READING_SIZE = 20;
+
+const round2 = (value) => Math.round(value * 100) / 100;
+
+function toHex(bytes) {
+  return Array.from(bytes, (b) => b.toString(16).padStart(2, "0")).join("");
+}
+
+// Decode a binary frame into the same shape as the JSON messages
+function decodeBinary(buffer) {
+  const view = new DataView(buffer);
+  const kind = view.getUint8(0);
+  if (kind === KIND_ERROR) {
+    return { error: new TextDecoder().decode(new Uint8Array(buffer, 1)) };
+  }
+  if (kind !== KIND_READING) {
+    return { error: `Unknown message kind ${kind}` };
+  }
+  const message = {
+    parsed: {
+      network_address: view.getUint16(2, true),
+      ld: view.getUint16(4, true),
+      pd: view.getUint16(6, true),
+      pcb_temperature: round2(view.getFloat32(8, true)),
+      dust_concentration: round2(view.getFloat32(12, true)),
+      current_loop: round2(view.getFloat32(16, true)),
+    },
+  };
+  if (view.getUint8(1) & FLAG_RAW) {
+    message.raw = toHex(new Uint8Array(buffer, READING_SIZE));
+  }
+  return message;
+}
+
 export async function startSensorStream(config = {}, onData) {
 
   if (socket) {
     socket.close();
     socket = null;
   }
-  
+
   socket = new WebSocket(`ws://${location.host}/ws/sensor`);
+  socket.binaryType = "arraybuffer";
 
   socket.onopen = () => {
     socket.send(JSON.stringify({
       continuous : Boolean(config.continuous),
       period_in_seconds: config.period,
-      network_address: config.networkAddress
+      network_address: config.networkAddress,
+      // Compact frames unless the caller needs JSON or the raw hex
+      format: config.format || "binary",
+      include_raw: Boolean(config.includeRaw),
+      // Push only when dust moves by more than this much (null = every reading)
+      min_delta: config.minDelta ?? null
     }));
   };
 
   socket.onmessage = (event) => {
-    const data = JSON.parse(event.data);
+    const data = typeof event.data === "string" ? JSON.parse(event.data) : decodeBinary(event.data);
     onData(data);
 
     // Auto-close after first response (single-shot)
@@ -0,0 +1,143 @@
+import asyncio, json, logging, time
+
+from device_communicator import SerialPort, port_present, search_serial_ports, serial_ports, state_listeners
+
+KEEPALIVE_SECONDS = 15
+
+
+class LinkSupervisor:
+    """Keeps the serial links up in the background.
+
+    Every interval it re-enumerates the adapters (refreshing the cached list
+    the request paths use), closes connections whose adapter disappeared and
+    retries wanted ports that are down: at once when the adapter shows up
+    again, otherwise with exponential back-off from backoff_base up to
+    backoff_max. While a port is down its commands fail fast with
+    NotConnectedError instead of each running the probe.
+
+    Connection state changes are fanned out to listener queues for the
+    /api/serial-ports/stream feed.
+    """
+
+    def __init__(self, interval=1.0, backoff_base=1.0, backoff_max=30.0):
+        self.interval = interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.listeners = set()
+        self.available = []
+        self.stats = {"checks": 0, "reconnect_attempts": 0, "reconnects": 0, "links_lost": 0, "events": 0}
+        self._task = None
+        self._loop = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            SerialPort.supervised = True
+            if self._on_state not in state_listeners:
+                state_listeners.append(self._on_state)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._on_state in state_listeners:
+            state_listeners.remove(self._on_state)
+        SerialPort.supervised = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                logging.exception("Serial link check failed")
+            await asyncio.sleep(self.interval)
+
+    async def check(self):
+        loop = asyncio.get_running_loop()
+        previous = set(self.available)
+        self.available = await asyncio.to_thread(search_serial_ports, 0)
+        self.stats["checks"] += 1
+        for serial_port in list(serial_ports.values()):
+            present = port_present(serial_port.port, self.available)
+            if serial_port.connection is not None:
+                if not present:
+                    self.stats["links_lost"] += 1
+                    await loop.run_in_executor(serial_port.executor, serial_port.mark_lost, "Adapter removed")
+                continue
+            if not serial_port.wanted:
+                continue
+            if not present:
+                serial_port.retry_at = 0.0  # try as soon as it is plugged back in
+                continue
+            if serial_port.port not in previous and serial_port.port in self.available:
+                serial_port.retry_at = 0.0  # hot-plugged
+            if time.monotonic() < serial_port.retry_at:
+                continue
+            self.stats["reconnect_attempts"] += 1
+            if await loop.run_in_executor(serial_port.executor, serial_port.reconnect):
+                self.stats["reconnects"] += 1
+                logging.info("Serial link on %s restored", serial_port.port)
+            else:
+                serial_port.failures += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (serial_port.failures - 1))
+                serial_port.retry_at = time.monotonic() + delay
+
+    def _on_state(self, status):
+        # Called from the serial I/O threads as well as the loop
+        if status["state"] == "down":
+            logging.warning("Serial link on %s down: %s", status["port"], status["error"])
+        self._loop.call_soon_threadsafe(self._publish, status)
+
+    def _publish(self, status):
+        self.stats["events"] += 1
+        for queue in self.listeners:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(status)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=100)
+        self.listeners.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.listeners.discard(queue)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            **self.stats,
+            "running": self._task is not None and not self._task.done(),
+            "available": self.available,
+            "ports": [
+                {**serial_port.status, "port": serial_port.port, "wanted": serial_port.wanted,
+                 "failures": serial_port.failures,
+                 "retry_in_seconds": round(max(0.0, serial_port.retry_at - now), 3)
+                 if serial_port.wanted and serial_port.connection is None else None}
+                for serial_port in list(serial_ports.values())
+            ],
+        }
+
+
+async def stream_states(supervisor, is_disconnected=None):
+    """SSE: the state of every port on connect, then each change as it happens."""
+    queue = supervisor.subscribe()
+    try:
+        for port in supervisor.snapshot()["ports"]:
+            yield f"event: link\ndata: {json.dumps(port, separators=(',', ':'))}\n\n"
+        while True:
+            try:
+                status = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: link\ndata: {json.dumps(status, separators=(',', ':'))}\n\n"
+    finally:
+        supervisor.unsubscribe(queue)
@@ -0,0 +1,130 @@
+import asyncio, json, logging
+
+from sqlalchemy import select
+
+from database import DeviceReading, READING_COLUMNS, SessionLocal, encode_cursor, query_readings, to_utc
+
+KEEPALIVE_SECONDS = 15
+RETRY_MS = 3000
+RESUME_PAGE = 500
+
+
+def reading_event(reading_id, row):
+    """Payload of one SSE reading, same field names as /api/readings."""
+    return {
+        "id": reading_id,
+        "timestamp": to_utc(row["timestamp"]).isoformat(),
+        "network_address": row["network_address"],
+        "dust": row["dust_concentration"],
+        "temp": row["pcb_temp"],
+        "current": row["current_loop"],
+        "ld": row["laser_diode_signal"],
+        "pd": row["photo_diode_signal"],
+    }
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: reading\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+class ReadingBroker:
+    """Fans newly ingested readings out to live-feed listeners by network address.
+
+    publish() is registered as a flush hook of the write-behind queue, so it
+    runs on the event loop with the ids the insert returned. Each listener has
+    a bounded queue; when a client cannot keep up its oldest events are
+    dropped and it can catch up from the table with Last-Event-ID.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.listeners = {}
+        self.stats = {"published": 0, "dropped": 0}
+
+    def subscribe(self, network_address):
+        queue = asyncio.Queue(maxsize=self.maxsize)
+        self.listeners.setdefault(network_address, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, network_address, queue):
+        listeners = self.listeners.get(network_address)
+        if listeners is not None:
+            listeners.discard(queue)
+            if not listeners:
+                del self.listeners[network_address]
+
+    def publish(self, rows, ids):
+        for row, reading_id in zip(rows, ids):
+            listeners = self.listeners.get(row["network_address"])
+            if not listeners:
+                continue
+            event = reading_event(reading_id, row)
+            self.stats["published"] += 1
+            for queue in listeners:
+                if queue.full():
+                    queue.get_nowait()
+                    self.stats["dropped"] += 1
+                queue.put_nowait(event)
+
+    def snapshot(self):
+        return {**self.stats, "listeners": sum(len(queues) for queues in self.listeners.values())}
+
+
+def missed_readings(network_address, last_id, limit=RESUME_PAGE):
+    """Readings of network_address with id > last_id, oldest first (one page).
+
+    Ids follow insertion order, so this is a keyset page on (timestamp, id)
+    from the last reading the client saw, served by the device/time index.
+    """
+    db = SessionLocal()
+    try:
+        last_seen = db.execute(select(DeviceReading.timestamp).where(DeviceReading.id == last_id)).scalar()
+        if last_seen is not None:
+            rows, _ = query_readings(db, network_address, limit=limit, cursor=encode_cursor(last_seen, last_id))
+        else:
+            # That row is gone (retention), fall back to the primary key
+            rows = db.execute(
+                select(*READING_COLUMNS)
+                .where(DeviceReading.network_address == network_address, DeviceReading.id > last_id)
+                .order_by(DeviceReading.id)
+                .limit(limit)
+            ).all()
+        return [reading_event(row.id, row._mapping) for row in rows]
+    finally:
+        db.close()
+
+
+async def stream_readings(broker, network_address, last_event_id=None, is_disconnected=None):
+    """SSE body: missed readings after last_event_id, then live ones as they land."""
+    queue = broker.subscribe(network_address)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        last_sent = last_event_id
+        if last_event_id is not None:
+            # Listening already, so nothing ingested during the catch-up is lost
+            while True:
+                events = await asyncio.to_thread(missed_readings, network_address, last_sent)
+                for event in events:
+                    yield format_sse(event)
+                    last_sent = event["id"]
+                if len(events) < RESUME_PAGE:
+                    break
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            if last_sent is not None and event["id"] <= last_sent:
+                continue  # already sent during the catch-up
+            yield format_sse(event)
+            last_sent = event["id"]
+    except Exception:
+        logging.exception("Live feed for address %s stopped", network_address)
+    finally:
+        broker.unsubscribe(network_address, queue)
+
+
+broker = ReadingBroker()
@@ -0,0 +1,141 @@
+import asyncio, heapq, itertools, logging, time
+
+from device_communicator import transact_async
+from protocol import encode_command, decode_frame
+from serial_timing import DeviceBackoffError
+
+
+class ScheduledDevice:
+    """Roster entry plus the per-device counters reported by the scheduler."""
+
+    def __init__(self, network_address, period, port=None):
+        self.network_address = network_address
+        self.period = period
+        self.port = port
+        self.next_due = 0.0
+        self.polls = 0
+        self.responses = 0
+        self.missed = 0
+        self.skipped = 0
+        self.consecutive_missed = 0
+        self.last_error = None
+        self.last_response_at = None
+
+    def command(self):
+        # Bytes 5 and 6 > 250 request a single-shot reading, the scheduler is the clock
+        return encode_command(self.network_address, 0xC9, 0xFF, 0xFF)
+
+    def status(self, elapsed):
+        return {
+            "network_address": self.network_address,
+            "port": self.port,
+            "period_in_seconds": self.period,
+            "requested_rate_hz": round(1 / self.period, 3),
+            "achieved_rate_hz": round(self.responses / elapsed, 3) if elapsed > 0 else 0.0,
+            "polls": self.polls,
+            "responses": self.responses,
+            "missed": self.missed,
+            "skipped": self.skipped,
+            "consecutive_missed": self.consecutive_missed,
+            "last_error": self.last_error,
+            "last_response_at": self.last_response_at,
+        }
+
+
+class PollScheduler:
+    """Polls a roster of devices spread over one or more RS-485 buses.
+
+    Each port gets its own loop, so buses are polled in parallel. Within a bus
+    requests are interleaved across network addresses in order of when each
+    device is next due, sent back to back when several are due at once. Every
+    valid reading is passed to on_reading, which persists it.
+    """
+
+    def __init__(self, roster, on_reading=None):
+        self.devices = [ScheduledDevice(entry["network_address"], entry["period_in_seconds"], entry.get("port")) for entry in roster]
+        self.on_reading = on_reading
+        self._task = None
+        self._started_at = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._started_at = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        buses = {}
+        for device in self.devices:
+            buses.setdefault(device.port, []).append(device)
+        await asyncio.gather(*(self._run_bus(devices) for devices in buses.values()))
+
+    async def _run_bus(self, devices):
+        loop = asyncio.get_running_loop()
+        counter = itertools.count()  # tie-breaker so devices are never compared
+        heap = []
+        now = loop.time()
+        for device in devices:
+            device.next_due = now
+            heapq.heappush(heap, (device.next_due, next(counter), device))
+
+        while heap:
+            due, _, device = heapq.heappop(heap)
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._poll(device)
+            # Missed slots are not replayed in a burst, the device just goes next
+            device.next_due = max(due + device.period, loop.time())
+            heapq.heappush(heap, (device.next_due, next(counter), device))
+
+    async def _poll(self, device):
+        try:
+            resp = await transact_async(device.command(), port=device.port, backoff=True)
+        except DeviceBackoffError as e:
+            # Not answering lately, its slot goes to the devices that do
+            device.skipped += 1
+            device.last_error = str(e)
+            return
+        except Exception as e:
+            resp = None
+            parsed = {"error": str(e)}
+        device.polls += 1
+        if resp is not None:
+            parsed = decode_frame(resp)
+        if "network_address" not in parsed:
+            device.missed += 1
+            device.consecutive_missed += 1
+            device.last_error = parsed.get("error", "unexpected response")
+            return
+        device.responses += 1
+        device.consecutive_missed = 0
+        device.last_error = None
+        device.last_response_at = time.time()
+        if self.on_reading is not None:
+            try:
+                await self.on_reading(parsed)
+            except Exception:
+                logging.exception("Failed to persist reading from address %s", device.network_address)
+
+    def status(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        devices = [device.status(elapsed) for device in self.devices]
+        return {
+            "running": self.running,
+            "elapsed_seconds": round(elapsed, 3),
+            "requested_rate_hz": round(sum(d["requested_rate_hz"] for d in devices), 3),
+            "achieved_rate_hz": round(sum(d["achieved_rate_hz"] for d in devices), 3),
+            "devices": devices,
+        }
@@ -0,0 +1,267 @@
+import struct, sys
+
+from metrics import DECODE_ERRORS
+
+# Framing for the dust sensor serial protocol. Every response frame looks like
+#   FA <length> <addr hi> <addr lo> <cmd> <payload ...> <checksum> F5
+# where length counts the whole frame and checksum is the sum of all bytes
+# before it, modulo 256.
+
+FRAME_START = 0xFA
+FRAME_END = 0xF5
+MIN_FRAME_LENGTH = 7
+MAX_FRAME_LENGTH = 128  # longest known response (0x98 system info) is ~63 bytes
+
+
+def frame_checksum(frame) -> int:
+    return sum(frame[:-2]) % 0x100
+
+
+class FrameDecoder:
+    """Incremental frame decoder over a byte buffer.
+
+    feed() accepts chunks of any size (whatever in_waiting returned, or blocks
+    of a capture file) and returns the complete, validated frames found so far.
+    A frame with a bad length, end byte or checksum costs only its start byte:
+    the decoder resynchronises on the next 0xFA without dropping later data.
+    """
+
+    def __init__(self, verify_checksum=True, max_buffer=4096):
+        self.verify_checksum = verify_checksum
+        self.max_buffer = max_buffer
+        self.buffer = bytearray()
+        self.pos = 0  # start of unconsumed data, compacted lazily
+        self.stats = {"frames": 0, "discarded_bytes": 0, "bad_length": 0, "bad_end": 0, "bad_checksum": 0}
+
+    def __len__(self):
+        return len(self.buffer) - self.pos
+
+    def feed(self, data) -> list:
+        if data:
+            self.buffer += data
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        self._compact()
+        return frames
+
+    def resync(self):
+        """Give up on a partial frame at the head of the buffer, e.g. after a
+        read timeout, so a corrupted length byte cannot stall the stream."""
+        if len(self):
+            self._discard(1)
+            self._compact()
+
+    def needed(self):
+        """Bytes still missing from the frame at the head of the buffer, at
+        least 1; a read of this size completes it (2 while no header is in)."""
+        buf = self.buffer
+        start = buf.find(FRAME_START, self.pos)
+        if start < 0:
+            return 2
+        if len(buf) - start < 2:
+            return 1
+        return max(1, buf[start + 1] - (len(buf) - start))
+
+    def reset(self):
+        self.buffer.clear()
+        self.pos = 0
+
+    def _discard(self, count):
+        self.pos += count
+        self.stats["discarded_bytes"] += count
+
+    def _compact(self):
+        if self.pos and (self.pos >= len(self.buffer) or self.pos > self.max_buffer // 2):
+            del self.buffer[:self.pos]
+            self.pos = 0
+        # Never buffer unbounded garbage waiting for a frame that will not come
+        overflow = len(self) - self.max_buffer
+        if overflow > 0:
+            self._discard(overflow)
+            del self.buffer[:self.pos]
+            self.pos = 0
+
+    def _next_frame(self):
+        buf = self.buffer
+        while True:
+            start = buf.find(FRAME_START, self.pos)
+            if start < 0:
+                self._discard(len(buf) - self.pos)
+                return None
+            if start > self.pos:
+                self._discard(start - self.pos)
+            if len(buf) - start < 2:
+                return None
+            length = buf[start + 1]
+            if length < MIN_FRAME_LENGTH or length > MAX_FRAME_LENGTH:
+                self.stats["bad_length"] += 1
+                DECODE_ERRORS.inc("bad_length")
+                self._discard(1)
+                continue
+            if len(buf) - start < length:
+                # A stray 0xFA with a plausible length would hold up every
+                # frame behind it; give up on it once a later frame validates
+                later = self._later_frame(start)
+                if later is None:
+                    return None
+                self.stats["bad_length"] += 1
+                DECODE_ERRORS.inc("bad_length")
+                self._discard(later - self.pos)
+                continue
+            frame = bytes(buf[start:start + length])
+            if frame[-1] != FRAME_END:
+                self.stats["bad_end"] += 1
+                DECODE_ERRORS.inc("bad_end")
+                self._discard(1)
+                continue
+            if self.verify_checksum and frame_checksum(frame) != frame[-2]:
+                self.stats["bad_checksum"] += 1
+                DECODE_ERRORS.inc("checksum")
+                self._discard(1)
+                continue
+            self.pos = start + length
+            self.stats["frames"] += 1
+            return frame
+
+    def _later_frame(self, start):
+        """Offset of the first complete, valid frame after start, or None."""
+        buf = self.buffer
+        candidate = buf.find(FRAME_START, start + 1)
+        while candidate >= 0 and len(buf) - candidate >= MIN_FRAME_LENGTH:
+            length = buf[candidate + 1]
+            end = candidate + length
+            if (MIN_FRAME_LENGTH <= length <= MAX_FRAME_LENGTH and end <= len(buf) and buf[end - 1] == FRAME_END
+                    and (not self.verify_checksum or sum(buf[candidate:end - 2]) % 0x100 == buf[end - 2])):
+                return candidate
+            candidate = buf.find(FRAME_START, candidate + 1)
+        return None
+
+
+# Commands are always 7 bytes: FA <addr hi> <addr lo> <cmd> <byte5> <byte6> <checksum>
+COMMAND = struct.Struct(">BHBBB")
+
+def encode_command(network_address, cmd_id, byte5=0x00, byte6=0x00) -> bytes:
+    """Build a command frame as bytes, checksum included."""
+    body = COMMAND.pack(FRAME_START, network_address & 0xFFFF, cmd_id, byte5 & 0xFF, byte6 & 0xFF)
+    return body + bytes((sum(body) % 0x100,))
+
+def encode_value_command(network_address, cmd_id, value) -> bytes:
+    """Command carrying a 16-bit big-endian value in bytes 5 and 6."""
+    return encode_command(network_address, cmd_id, (value >> 8) & 0xFF, value & 0xFF)
+
+
+# Field layouts of the two data responses, offsets as documented for the device
+C9_FRAME = struct.Struct(">2xHxHH10xH4xf4xH4x")             # 39 bytes
+SYSTEM_INFO_FRAME = struct.Struct(">2xHxfHf26xf4xHH2xH2xH")  # 61 bytes, device may send more
+FLOAT_AT_5 = struct.Struct(">5xf")
+UINT16_AT_5 = struct.Struct(">5xH")
+UINT16_AT_2 = struct.Struct(">2xH")
+
+def _decode_c9(b):
+    if len(b) < C9_FRAME.size:
+        DECODE_ERRORS.inc("short")
+        return {"error": "incomplete response for command C9"}
+    if frame_checksum(b) != b[-2]:
+        DECODE_ERRORS.inc("checksum")
+        return {"error": "Checksum failed"}
+    network_address, ld, pd, temp_raw, dust, current = C9_FRAME.unpack_from(b)
+    return {
+        "network_address": network_address,
+        "ld": ld,
+        "pd": pd,
+        "pcb_temperature": round(25 - (temp_raw - 1065) * 1025 / 4096, 2),
+        "dust_concentration": round(dust, 2),
+        "current_loop": current / 100,
+    }
+
+def _decode_system_info(b):
+    if len(b) < SYSTEM_INFO_FRAME.size:
+        DECODE_ERRORS.inc("short")
+        return {"error": "incomplete response for command 98"}
+    (network_address, calibration_factor, range_value, calibration_b, smoothing_time,
+     temp_auth_days, user_hours, msn, alarm_threshold) = SYSTEM_INFO_FRAME.unpack_from(b)
+    decoded_resp = {"network_address_info": network_address, "calibration_factor": round(calibration_factor, 3)}
+    if decoded_resp["calibration_factor"] > 10:
+        decoded_resp["calibration_a"] = 10.0
+    elif decoded_resp["calibration_factor"] < 10:
+        decoded_resp["calibration_a"] = decoded_resp["calibration_factor"]
+    decoded_resp["range"] = range_value
+    decoded_resp["calibration_b"] = round(calibration_b, 3)
+    decoded_resp["smoothing_time_sec"] = smoothing_time
+    decoded_resp["temp_auth_days"] = temp_auth_days
+    decoded_resp["TimeUserHours"] = user_hours
+    decoded_resp["MSN"] = msn
+    decoded_resp["alarm_threshold"] = alarm_threshold
+    return decoded_resp
+
+def _ack(key, field=None, layout=None, transform=None):
+    def decode(b):
+        decoded_resp = {key: "Success"}
+        if field is not None:
+            value = layout.unpack_from(b)[0]
+            decoded_resp[field] = transform(value) if transform else value
+        return decoded_resp
+    return decode
+
+# Response decoders keyed on the command byte (frame[4])
+DECODERS = {
+    0xC9: _decode_c9,
+    0x98: _decode_system_info,
+    0x97: _ack("set_network_address_ack", "new_network_address", UINT16_AT_2),
+    0x8C: _ack("set_smoothing_time_ack", "new_smoothing_time_sec", FLOAT_AT_5),
+    0x9D: _ack("set_range_ack", "new_range", UINT16_AT_5),
+    0x9A: _ack("set_alarm_ack", "new_alarm_threshold", UINT16_AT_5),
+    0xCF: _ack("set_calibration_a_ack", "new_calibration_a", FLOAT_AT_5),
+    0xD0: _ack("set_calibration_b_ack", "new_calibration_b", FLOAT_AT_5),
+    0x9E: _ack("set_correction_value_ack", "new_correction_value", FLOAT_AT_5, lambda v: round(v, 3)),
+    0xA5: lambda b: {"set_cancel_correction_ack": "Success", "cancel_correction_value": 1.0},
+    0xD1: _ack("set_zero_calibration_ack"),
+    0xD2: _ack("cancel_zero_calibration_ack"),
+    0xD3: _ack("set_range_calibration_ack"),
+}
+
+def decode_frame(frame) -> dict:
+    """Decode a response frame (bytes, bytearray or memoryview) into sensor
+    fields. Same output as device_communicator.decode_response, without the
+    hex round trip."""
+    if len(frame) >= 2 and frame[0] != FRAME_START:
+        DECODE_ERRORS.inc("bad_start")
+        return {"error": "invalid start byte in Response"}
+    if len(frame) >= 2 and frame[-1] != FRAME_END:
+        DECODE_ERRORS.inc("bad_end")
+        return {"error": "invalid end byte in Response"}
+    if len(frame) < 5:
+        DECODE_ERRORS.inc("short")
+        return {"error": "incomplete response"}
+    decoder = DECODERS.get(frame[4])
+    if decoder is None:
+        return {}
+    try:
+        return decoder(frame)
+    except struct.error:
+        DECODE_ERRORS.inc("short")
+        return {"error": f"incomplete response for command {frame[4]:02X}"}
+
+
+def iter_frames(stream, chunk_size=65536, decoder=None):
+    """Yield validated frames from a binary file-like object (offline replay)."""
+    decoder = decoder or FrameDecoder()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield from decoder.feed(chunk)
+
+
+if __name__ == "__main__":
+    # python protocol.py capture.bin  -> frame counts per command id
+    counts = {}
+    decoder = FrameDecoder()
+    with open(sys.argv[1], "rb") as f:
+        for frame in iter_frames(f, decoder=decoder):
+            counts[f"{frame[4]:02x}"] = counts.get(f"{frame[4]:02x}", 0) + 1
+    print({"frames": counts, **decoder.stats})
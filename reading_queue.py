@@ -0,0 +1,151 @@
+import asyncio, logging, time
+
+from database import SessionLocal
+from rollups import ingest_readings
+
+
+class ReadingWriteQueue:
+    """Write-behind buffer between the ingest paths and the readings table.
+
+    Request handlers hand readings over with put()/submit() and return straight
+    away. A single writer task drains the queue, coalesces rows into bulk
+    inserts (plus rollup updates) and commits them on a worker thread so
+    SQLite fsyncs never run on the event loop.
+    """
+
+    def __init__(self, maxsize=10000, batch_size=500, flush_interval=1.0, overflow="drop_oldest"):
+        if overflow not in ("drop_oldest", "block"):
+            raise ValueError("overflow must be 'drop_oldest' or 'block'")
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.queue = None
+        self._task = None
+        self._stopping = False
+        # Called on the event loop as hook(rows, ids) after every successful flush
+        self.flush_hooks = []
+        self.stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "flushed_rows": 0,
+            "failed_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    async def start(self):
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued and stop the writer task."""
+        if not self.running:
+            return
+        # No new rows from here on. The sentinel waits for room rather than
+        # evicting a queued row, the writer flushes everything before it and exits.
+        self._stopping = True
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+        self._stopping = False
+
+    def submit(self, row):
+        """Queue a row without waiting. When full the oldest row is dropped."""
+        if not self.running:
+            raise RuntimeError("Reading queue is not running")
+        self._put_nowait(row)
+        self.stats["enqueued"] += 1
+
+    async def put(self, row):
+        """Queue a row, applying the configured overflow policy."""
+        if self.overflow == "block":
+            if not self.running:
+                raise RuntimeError("Reading queue is not running")
+            await self.queue.put(row)
+            self.stats["enqueued"] += 1
+        else:
+            self.submit(row)
+
+    def _put_nowait(self, item):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.stats["dropped"] += 1
+        self.queue.put_nowait(item)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            ids = await asyncio.to_thread(self._write, batch)
+        except Exception:
+            logging.exception("Failed to write %d queued readings", len(batch))
+            self.stats["failed_rows"] += len(batch)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats["flushes"] += 1
+        self.stats["flushed_rows"] += len(batch)
+        self.stats["last_flush_ms"] = round(elapsed_ms, 3)
+        self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed_ms), 3)
+        self.stats["total_flush_ms"] += elapsed_ms
+        for hook in self.flush_hooks:
+            try:
+                hook(batch, ids)
+            except Exception:
+                logging.exception("Reading queue flush hook failed")
+
+    def _write(self, batch):
+        db = SessionLocal()
+        try:
+            return ingest_readings(db, batch)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def snapshot(self):
+        """Counters for the ingest-stats endpoint."""
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "total_flush_ms": round(self.stats["total_flush_ms"], 3),
+            "avg_flush_ms": round(self.stats["total_flush_ms"] / flushes, 3) if flushes else 0.0,
+            "depth": self.queue.qsize() if self.queue is not None else 0,
+            "maxsize": self.maxsize,
+            "running": self.running,
+        }
@@ -0,0 +1,221 @@
+import argparse, asyncio, json, logging, time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select, tuple_
+
+from database import DeviceReading, ReadingRollup1m, ReadingRollup1h, ReadingRollup1d, SessionLocal, get_engine, init_db, to_utc, utc_bound
+
+# Config key -> table it prunes. Raw readings go first, coarser tiers last.
+RETENTION_TABLES = (
+    ("raw_days", DeviceReading),
+    ("rollup_1m_days", ReadingRollup1m),
+    ("rollup_1h_days", ReadingRollup1h),
+    ("rollup_1d_days", ReadingRollup1d),
+)
+
+
+class RetentionPolicy:
+    """Tiered retention for the readings store.
+
+    Raw readings are kept for raw_days, then only the rollups remain; each
+    rollup tier has its own age limit (None keeps it forever). Rows are
+    deleted in batches of batch_size, each in its own short transaction with
+    a pause in between, so the ingest writer is never locked out for long.
+    On SQLite the freed pages are then returned with an incremental vacuum.
+    """
+
+    def __init__(self, raw_days=90, rollup_1m_days=180, rollup_1h_days=730, rollup_1d_days=None,
+                 batch_size=5000, batch_pause=0.05, interval=3600, vacuum_pages=2000,
+                 session_factory=SessionLocal):
+        self.limits = {"raw_days": raw_days, "rollup_1m_days": rollup_1m_days,
+                       "rollup_1h_days": rollup_1h_days, "rollup_1d_days": rollup_1d_days}
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self.session_factory = session_factory
+        self._task = None
+        self.last_run = None
+        self.stats = {"runs": 0, "failures": 0, "rows_removed": 0, "pages_freed": 0, "total_seconds": 0.0}
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run)
+            except Exception:
+                logging.exception("Retention run failed")
+            await asyncio.sleep(self.interval)
+
+    def run(self, now=None):
+        """One retention pass over every table, returns a report of what it removed."""
+        now = now or datetime.now(timezone.utc)
+        started = time.perf_counter()
+        report = {"started_at": now.isoformat(), "removed": {}, "skipped": []}
+        try:
+            for key, model in RETENTION_TABLES:
+                days = self.limits[key]
+                if days is None:
+                    continue
+                cutoff = now.replace(tzinfo=None) - timedelta(days=days)
+                if model is DeviceReading:
+                    uncovered = self._uncovered_devices(cutoff)
+                    if uncovered:
+                        # Deleting now would lose history that exists nowhere else
+                        logging.warning("Retention: raw readings of devices %s predate their daily rollups, "
+                                        "run 'python rollups.py --backfill' first", uncovered)
+                        report["skipped"].append(model.__tablename__)
+                        continue
+                report["removed"][model.__tablename__] = self.prune(model, cutoff)
+            report["vacuum"] = self.incremental_vacuum()
+        except Exception as exc:
+            self.stats["failures"] += 1
+            report["error"] = str(exc)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            report["seconds"] = round(elapsed, 3)
+            report["rows_removed"] = sum(report["removed"].values())
+            self.stats["runs"] += 1
+            self.stats["rows_removed"] += report["rows_removed"]
+            self.stats["pages_freed"] += report.get("vacuum", {}).get("pages_freed", 0)
+            self.stats["total_seconds"] += elapsed
+            self.last_run = report
+            logging.info("Retention: removed %d rows in %.3fs", report["rows_removed"], elapsed)
+        return report
+
+    def _uncovered_devices(self, cutoff):
+        """Addresses with raw rows older than cutoff that the daily rollup does not reach back to.
+
+        The rollups only cover a device from its first 1d bucket on, so the
+        oldest raw reading must not be earlier than that bucket. Rows without
+        a network address are never rolled up and do not block the prune.
+        """
+        db = self.session_factory()
+        try:
+            oldest_raw = db.execute(
+                select(DeviceReading.network_address, func.min(DeviceReading.timestamp))
+                .where(DeviceReading.timestamp < utc_bound(cutoff), DeviceReading.network_address.isnot(None))
+                .group_by(DeviceReading.network_address)
+            ).all()
+            if not oldest_raw:
+                return []
+            first_bucket = dict(db.execute(
+                select(ReadingRollup1d.network_address, func.min(ReadingRollup1d.bucket_start))
+                .group_by(ReadingRollup1d.network_address)
+            ).all())
+            # bucket_start is naive UTC, readings.timestamp comes back aware on Postgres
+            return sorted(address for address, oldest in oldest_raw
+                          if first_bucket.get(address) is None or to_utc(first_bucket[address]) > to_utc(oldest))
+        finally:
+            db.close()
+
+    def prune(self, model, cutoff):
+        """Delete rows of model older than cutoff, batch_size rows per transaction."""
+        if model is DeviceReading:
+            key, age = (DeviceReading.id,), DeviceReading.timestamp
+            cutoff = utc_bound(cutoff)
+        else:
+            key, age = (model.network_address, model.bucket_start), model.bucket_start
+        removed = 0
+        db = self.session_factory()
+        try:
+            while True:
+                batch = select(*key).where(age < cutoff).limit(self.batch_size)
+                if len(key) == 1:
+                    stmt = delete(model).where(key[0].in_(batch))
+                else:
+                    stmt = delete(model).where(tuple_(*key).in_(batch))
+                deleted = db.execute(stmt).rowcount
+                db.commit()
+                removed += deleted
+                if deleted < self.batch_size:
+                    return removed
+                time.sleep(self.batch_pause)
+        finally:
+            db.close()
+
+    def incremental_vacuum(self):
+        """Return up to vacuum_pages free pages to the filesystem (SQLite only)."""
+        engine = get_engine()
+        if engine.dialect.name != "sqlite":
+            return {"mode": engine.dialect.name, "pages_freed": 0}
+        with engine.connect() as conn:
+            mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+            before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if mode != 2:
+                return {"mode": "none" if mode == 0 else "full", "free_pages": before, "pages_freed": 0}
+            # The pragma frees one page per step and the sqlite3 module steps
+            # a statement without result columns only once; executescript
+            # runs it to completion.
+            conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+            after = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        return {"mode": "incremental", "free_pages": after, "pages_freed": before - after}
+
+    def snapshot(self):
+        """Counters for the retention-stats endpoint."""
+        return {
+            **self.stats,
+            "total_seconds": round(self.stats["total_seconds"], 3),
+            "limits": self.limits,
+            "interval_seconds": self.interval,
+            "running": self.running,
+            "last_run": self.last_run,
+        }
+
+
+def from_config(cfg):
+    """Build a RetentionPolicy from the "retention" section of config.json."""
+    return RetentionPolicy(
+        raw_days=cfg.get("raw_days", 90),
+        rollup_1m_days=cfg.get("rollup_1m_days", 180),
+        rollup_1h_days=cfg.get("rollup_1h_days", 730),
+        rollup_1d_days=cfg.get("rollup_1d_days"),
+        batch_size=cfg.get("batch_size", 5000),
+        batch_pause=cfg.get("batch_pause_seconds", 0.05),
+        interval=cfg.get("interval_minutes", 60) * 60,
+        vacuum_pages=cfg.get("vacuum_pages", 2000),
+    )
+
+
+def enable_incremental_vacuum():
+    """Switch an existing SQLite file to auto_vacuum=INCREMENTAL.
+
+    Needs one full VACUUM, which rewrites the whole file; run it while the
+    app is stopped.
+    """
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+
+
+if __name__ == "__main__":
+    from device_communicator import load_config
+
+    parser = argparse.ArgumentParser(description="Apply the readings retention policy from config.json")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="convert an existing SQLite database (full VACUUM, app must be stopped)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    if args.enable_incremental_vacuum:
+        print(json.dumps({"auto_vacuum": enable_incremental_vacuum()}))
+    else:
+        print(json.dumps(from_config(load_config().get("retention", {})).run()))
@@ -0,0 +1,207 @@
+import argparse, json, logging, time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, case, delete, func, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import DeviceReading, ROLLUP_MODELS, SessionLocal, init_db, to_utc, utc_bound
+
+# Rollup column prefix -> reading row key / DeviceReading column name
+ROLLUP_FIELDS = {"dust": "dust_concentration", "temp": "pcb_temp", "current": "current_loop"}
+UPSERT_CHUNK = 1000
+
+
+def bucket_start(timestamp, seconds):
+    epoch = int(to_utc(timestamp).replace(tzinfo=timezone.utc).timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, timezone.utc).replace(tzinfo=None)
+
+
+def fold_rows(rows, seconds):
+    """Aggregate reading rows into {(network_address, bucket_start): rollup values}."""
+    buckets = {}
+    for row in rows:
+        timestamp = to_utc(row["timestamp"])
+        key = (row["network_address"], bucket_start(timestamp, seconds))
+        agg = buckets.get(key)
+        if agg is None:
+            agg = buckets[key] = {"network_address": key[0], "bucket_start": key[1], "count": 0, "last_timestamp": None}
+            for prefix in ROLLUP_FIELDS:
+                agg.update({f"{prefix}_sum": None, f"{prefix}_min": None, f"{prefix}_max": None, f"{prefix}_last": None})
+        agg["count"] += 1
+        newest = agg["last_timestamp"] is None or timestamp >= agg["last_timestamp"]
+        if newest:
+            agg["last_timestamp"] = timestamp
+        for prefix, column in ROLLUP_FIELDS.items():
+            value = row.get(column)
+            if value is None:
+                continue
+            agg[f"{prefix}_sum"] = value if agg[f"{prefix}_sum"] is None else agg[f"{prefix}_sum"] + value
+            agg[f"{prefix}_min"] = value if agg[f"{prefix}_min"] is None else min(agg[f"{prefix}_min"], value)
+            agg[f"{prefix}_max"] = value if agg[f"{prefix}_max"] is None else max(agg[f"{prefix}_max"], value)
+            if newest:
+                agg[f"{prefix}_last"] = value
+    return buckets
+
+
+def _merge(old, new, combine):
+    # NULL means "no value yet" on either side
+    return case((old.is_(None), new), (new.is_(None), old), else_=combine(old, new))
+
+def merge_rollups(db, model, buckets):
+    """Merge folded buckets into a rollup table row by row, read then update or insert.
+
+    The portable path for databases without INSERT .. ON CONFLICT; fine for
+    the single ingest writer, concurrent writers to one bucket would race.
+    """
+    for key, agg in buckets.items():
+        row = db.get(model, key)
+        if row is None:
+            db.add(model(**agg))
+            continue
+        newer = row.last_timestamp is None or agg["last_timestamp"] >= to_utc(row.last_timestamp)
+        row.count += agg["count"]
+        if newer:
+            row.last_timestamp = agg["last_timestamp"]
+        for prefix in ROLLUP_FIELDS:
+            for stat, combine in (("sum", lambda a, b: a + b), ("min", min), ("max", max)):
+                name = f"{prefix}_{stat}"
+                old, new = getattr(row, name), agg[name]
+                setattr(row, name, new if old is None else old if new is None else combine(old, new))
+            if newer and agg[f"{prefix}_last"] is not None:
+                setattr(row, f"{prefix}_last", agg[f"{prefix}_last"])
+
+def upsert_rollups(db, model, buckets):
+    """Merge folded buckets into a rollup table with INSERT .. ON CONFLICT DO UPDATE
+    on SQLite and Postgres, through merge_rollups on other databases."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        dialect_insert, least, greatest = sqlite.insert, func.min, func.max
+    elif dialect == "postgresql":
+        dialect_insert, least, greatest = postgresql.insert, func.least, func.greatest
+    else:
+        return merge_rollups(db, model, buckets)
+
+    values = list(buckets.values())
+    for offset in range(0, len(values), UPSERT_CHUNK):
+        stmt = dialect_insert(model).values(values[offset:offset + UPSERT_CHUNK])
+        new = stmt.excluded
+        newer = or_(model.last_timestamp.is_(None), new.last_timestamp >= model.last_timestamp)
+        update = {
+            "count": model.count + new.count,
+            "last_timestamp": case((newer, new.last_timestamp), else_=model.last_timestamp),
+        }
+        for prefix in ROLLUP_FIELDS:
+            old_col, new_col = getattr(model, f"{prefix}_sum"), getattr(new, f"{prefix}_sum")
+            update[f"{prefix}_sum"] = _merge(old_col, new_col, lambda a, b: a + b)
+            old_col, new_col = getattr(model, f"{prefix}_min"), getattr(new, f"{prefix}_min")
+            update[f"{prefix}_min"] = _merge(old_col, new_col, least)
+            old_col, new_col = getattr(model, f"{prefix}_max"), getattr(new, f"{prefix}_max")
+            update[f"{prefix}_max"] = _merge(old_col, new_col, greatest)
+            old_col, new_col = getattr(model, f"{prefix}_last"), getattr(new, f"{prefix}_last")
+            update[f"{prefix}_last"] = case((and_(newer, new_col.isnot(None)), new_col), else_=old_col)
+        db.execute(stmt.on_conflict_do_update(index_elements=[model.network_address, model.bucket_start], set_=update))
+
+def update_rollups(db, rows):
+    for model in ROLLUP_MODELS:
+        upsert_rollups(db, model, fold_rows(rows, model.bucket_seconds))
+
+
+def ingest_readings(db, rows):
+    """Insert reading rows and fold them into every rollup, in one transaction.
+
+    Returns the new reading ids in the order of rows.
+    """
+    if not rows:
+        return []
+    ids = db.execute(insert(DeviceReading).returning(DeviceReading.id, sort_by_parameter_order=True), rows).scalars().all()
+    update_rollups(db, rows)
+    db.commit()
+    return ids
+
+
+def rebuild_starts(db):
+    """{(model, network_address): first bucket_start to rebuild} from the raw rows left.
+
+    Older buckets are all that remains of readings retention has pruned and
+    are kept. So is the bucket holding a device's oldest raw reading when its
+    rollup counts more readings than are left in it.
+    """
+    starts = {}
+    oldest = db.execute(
+        select(DeviceReading.network_address, func.min(DeviceReading.timestamp))
+        .where(DeviceReading.network_address.isnot(None))
+        .group_by(DeviceReading.network_address)
+    ).all()
+    for address, timestamp in oldest:
+        for model in ROLLUP_MODELS:
+            start = bucket_start(timestamp, model.bucket_seconds)
+            end = start + timedelta(seconds=model.bucket_seconds)
+            rolled_up = db.execute(
+                select(model.count).where(model.network_address == address, model.bucket_start == start)
+            ).scalar()
+            if rolled_up:
+                raw = db.execute(
+                    select(func.count()).select_from(DeviceReading)
+                    .where(DeviceReading.network_address == address,
+                           DeviceReading.timestamp >= utc_bound(start), DeviceReading.timestamp < utc_bound(end))
+                ).scalar()
+                if rolled_up > raw:
+                    start = end
+            starts[(model, address)] = start
+    return starts
+
+def backfill(chunk_size=50000, session_factory=SessionLocal):
+    """Rebuild the rollups from the readings table, chunk by chunk on id.
+
+    Only buckets the remaining raw rows fully cover are cleared and rebuilt
+    (see rebuild_starts), so running it after retention has pruned raw rows
+    keeps the older history. Rows inserted while the backfill runs are folded
+    by ingest as usual: the rollups are cleared and the id high-water mark
+    taken in one transaction.
+    """
+    started = time.perf_counter()
+    db = session_factory()
+    try:
+        starts = rebuild_starts(db)
+        for (model, address), start in starts.items():
+            db.execute(delete(model).where(model.network_address == address, model.bucket_start >= start))
+        max_id = db.execute(select(func.max(DeviceReading.id))).scalar() or 0
+        db.commit()
+
+        columns = [DeviceReading.id, DeviceReading.timestamp, DeviceReading.network_address]
+        columns += [getattr(DeviceReading, column) for column in ROLLUP_FIELDS.values()]
+        last_id, total = 0, 0
+        while last_id < max_id:
+            rows = db.execute(
+                select(*columns)
+                .where(DeviceReading.id > last_id, DeviceReading.id <= max_id, DeviceReading.network_address.isnot(None))
+                .order_by(DeviceReading.id)
+                .limit(chunk_size)
+            ).mappings().all()
+            if not rows:
+                break
+            for model in ROLLUP_MODELS:
+                buckets = fold_rows(rows, model.bucket_seconds)
+                # A device first seen during the backfill is already rolled up by ingest
+                upsert_rollups(db, model, {key: agg for key, agg in buckets.items()
+                                           if (model, key[0]) in starts and key[1] >= starts[(model, key[0])]})
+            db.commit()
+            last_id = rows[-1]["id"]
+            total += len(rows)
+            logging.info("Rollup backfill: %d rows (id <= %d of %d)", total, last_id, max_id)
+        return {"rows": total, "seconds": round(time.perf_counter() - started, 3)}
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the readings rollup tables")
+    parser.add_argument("--backfill", action="store_true", help="rebuild the rollups from the raw readings still in the readings table")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+    if args.backfill:
+        logging.basicConfig(level=logging.INFO)
+        init_db()
+        print(json.dumps(backfill(args.chunk_size)))
+    else:
+        parser.print_help()
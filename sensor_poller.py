@@ -0,0 +1,190 @@
+import asyncio, logging
+
+from device_communicator import resolve_port_async, transact_async
+from protocol import encode_command, decode_frame
+
+
+class Subscription:
+    """One viewer of a SensorPoller. Frames are delivered no faster than the
+    subscriber's own period even when the poller runs faster for someone else.
+
+    Delivery goes through a one-message slot: the newest frame replaces any
+    frame the client has not picked up yet, so a slow client only ever falls
+    behind by one frame and never holds up the poll loop. With min_delta set,
+    readings are only pushed when the dust concentration has moved by more
+    than min_delta since the last one pushed (errors always go through).
+    """
+
+    def __init__(self, poller, period, min_delta=None, client=None):
+        self.poller = poller
+        self.period = period
+        self.min_delta = min_delta
+        self.client = client
+        self._last_delivery = None
+        self._last_dust = None
+        self._latest = None
+        self._ready = asyncio.Event()
+        self._delivered_at = None
+        self.closed = False
+        self.stats = {
+            "delivered": 0,
+            "sent": 0,
+            "coalesced": 0,
+            "suppressed": 0,
+            "last_lag_ms": 0.0,
+            "max_lag_ms": 0.0,
+            "total_lag_ms": 0.0,
+        }
+
+    def deliver(self, message, now):
+        # Half a tick of tolerance so sleep jitter does not skip whole periods
+        if self._last_delivery is not None and now - self._last_delivery < self.period - self.poller.period / 2:
+            return
+        if self.min_delta is not None and not self._changed(message):
+            self.stats["suppressed"] += 1
+            return
+        self._last_delivery = now
+        if self._ready.is_set():
+            self.stats["coalesced"] += 1  # the client never saw the previous one
+        self._latest = message
+        self._delivered_at = now
+        self.stats["delivered"] += 1
+        self._ready.set()
+
+    def _changed(self, message):
+        dust = (message.get("parsed") or {}).get("dust_concentration")
+        if dust is None:
+            return True
+        if self._last_dust is not None and abs(dust - self._last_dust) <= self.min_delta:
+            return False
+        self._last_dust = dust
+        return True
+
+    def close(self, reason):
+        """Dropped by the poller: the client gets reason as its last message."""
+        self.closed = True
+        self._latest = {"error": reason}
+        self._ready.set()
+
+    async def get(self):
+        """Wait for the newest undelivered message."""
+        await self._ready.wait()
+        self._ready.clear()
+        message, self._latest = self._latest, None
+        return message
+
+    def sent(self, now):
+        """Record that the message returned by get() reached the client."""
+        lag_ms = (now - self._delivered_at) * 1000
+        self.stats["sent"] += 1
+        self.stats["last_lag_ms"] = round(lag_ms, 3)
+        self.stats["max_lag_ms"] = round(max(self.stats["max_lag_ms"], lag_ms), 3)
+        self.stats["total_lag_ms"] += lag_ms
+
+    def snapshot(self):
+        sent = self.stats["sent"]
+        return {
+            "client": self.client,
+            "network_address": self.poller.network_address,
+            "port": self.poller.port,
+            "period": self.period,
+            "min_delta": self.min_delta,
+            **self.stats,
+            "total_lag_ms": round(self.stats["total_lag_ms"], 3),
+            "avg_lag_ms": round(self.stats["total_lag_ms"] / sent, 3) if sent else 0.0,
+            "pending": self._ready.is_set(),
+        }
+
+
+class SensorPoller:
+    """Single C9 poll loop for one network address, shared by all subscribers.
+
+    The device is read once per tick at the fastest period any subscriber asked
+    for and the decoded frame is broadcast to every subscriber. The loop stops
+    when the last subscriber leaves.
+    """
+
+    def __init__(self, network_address, port=None):
+        self.network_address = network_address
+        self.port = port
+        self.subscribers = set()
+        self._task = None
+
+    @property
+    def period(self):
+        return min(sub.period for sub in self.subscribers)
+
+    def command(self):
+        return encode_command(self.network_address, 0xC9, int(self.period * 10), 0x00)
+
+    def add(self, period, min_delta=None, client=None):
+        subscription = Subscription(self, period, min_delta, client)
+        self.subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscription
+
+    def remove(self, subscription):
+        self.subscribers.discard(subscription)
+        if not self.subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.subscribers:
+                started = loop.time()
+                try:
+                    resp = await transact_async(self.command(), port=self.port, backoff=True)
+                    message = {"raw": resp.hex(), "parsed": decode_frame(resp)}
+                except Exception as e:
+                    message = {"error": str(e)}
+                now = loop.time()
+                for subscription in list(self.subscribers):
+                    try:
+                        subscription.deliver(message, now)
+                    except Exception:
+                        # One bad subscriber must not stop the loop for the others
+                        logging.exception("Dropping subscriber %s of address %s", subscription.client, self.network_address)
+                        unsubscribe(subscription)
+                        subscription.close("Subscription dropped after a delivery error")
+                if not self.subscribers:
+                    break
+                await asyncio.sleep(max(0.0, self.period - (loop.time() - started)))
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logging.exception("Sensor poller for address %s stopped", self.network_address)
+
+
+# Keyed by (resolved port name, network_address), the same address may exist
+# on several buses and omitting the port means the default one
+pollers = {}
+
+async def subscribe(network_address, period, port=None, min_delta=None, client=None):
+    """Join (or start) the shared poller for network_address on port.
+    Raises UnknownPortError or NotConnectedError when port does not resolve."""
+    port = await resolve_port_async(port)
+    key = (port, network_address)
+    poller = pollers.get(key)
+    if poller is None:
+        poller = pollers[key] = SensorPoller(network_address, port)
+    return poller.add(period, min_delta, client)
+
+def unsubscribe(subscription):
+    """Leave the poller, which stops once nobody is watching."""
+    poller = subscription.poller
+    poller.remove(subscription)
+    key = (poller.port, poller.network_address)
+    if not poller.subscribers and pollers.get(key) is poller:
+        del pollers[key]
+
+def stop_all():
+    for poller in list(pollers.values()):
+        for subscription in list(poller.subscribers):
+            unsubscribe(subscription)
+
+def snapshot():
+    """Per-client delivery and lag counters for every live subscription."""
+    return [subscription.snapshot() for poller in pollers.values() for subscription in poller.subscribers]
@@ -0,0 +1,143 @@
+import time
+
+from protocol import C9_FRAME, SYSTEM_INFO_FRAME
+
+COMMAND_LENGTH = 7
+# Expected response length per command byte; everything else is an 11-byte ack.
+# System info is 61 bytes of fields plus checksum and end byte, some firmware sends more.
+RESPONSE_LENGTHS = {0xC9: C9_FRAME.size, 0x98: SYSTEM_INFO_FRAME.size + 2}
+ACK_LENGTH = 11
+
+
+class DeviceBackoffError(Exception):
+    """A periodic poll skipped because the device keeps timing out."""
+
+
+class ResponseTimer:
+    """Read timeouts and poll back-off for the devices on one serial line.
+
+    Until a device has answered a command, its timeout is the wire time of the
+    command and the expected response at the configured baud rate and frame
+    format, times margin, plus turnaround for the device to start replying.
+    After that it follows the measured round trip the way TCP sets its
+    retransmission timeout (RFC 6298): srtt + max(slack, 4 * rttvar), never
+    below the wire time. A timeout doubles the next one for that command, up
+    to max_timeout (the old fixed 1 s), so a slow device is still learned.
+
+    A device that misses backoff_after commands in a row is skipped by the
+    periodic pollers for backoff_base, doubling per further miss up to
+    backoff_max, so it stops taking bus time from devices that do answer.
+    Any response resets it.
+    """
+
+    def __init__(self, baudrate=9600, bytesize=8, parity="N", stopbits=1, turnaround=0.1, margin=1.5,
+                 slack=0.02, min_timeout=0.05, max_timeout=1.0, backoff_after=2, backoff_base=1.0,
+                 backoff_max=60.0):
+        self.baudrate = baudrate
+        # start bit + data bits + parity bit + stop bits
+        self.bits_per_byte = 1 + bytesize + (0 if str(parity).upper() == "N" else 1) + stopbits
+        self.turnaround = turnaround
+        self.margin = margin
+        self.slack = slack
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.backoff_after = backoff_after
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.estimates = {}  # (address, cmd) -> [srtt, rttvar, consecutive timeouts]
+        self.devices = {}  # address -> [consecutive failures, retry_at]
+
+    @classmethod
+    def from_config(cls, serial_cfg):
+        timing = serial_cfg.get("timing", {})
+        return cls(
+            baudrate=serial_cfg.get("baudrate", 9600),
+            bytesize=serial_cfg.get("bytesize", 8),
+            parity=serial_cfg.get("parity", "N"),
+            stopbits=serial_cfg.get("stopbits", 1),
+            turnaround=timing.get("turnaround_ms", 100) / 1000,
+            margin=timing.get("margin", 1.5),
+            slack=timing.get("slack_ms", 20) / 1000,
+            min_timeout=timing.get("min_timeout_ms", 50) / 1000,
+            max_timeout=timing.get("max_timeout_ms", 1000) / 1000,
+            backoff_after=timing.get("backoff_after_misses", 2),
+            backoff_base=timing.get("backoff_base_seconds", 1.0),
+            backoff_max=timing.get("backoff_max_seconds", 60.0),
+        )
+
+    def wire_time(self, cmd_id):
+        """Seconds to send the command and receive its expected response."""
+        nbytes = COMMAND_LENGTH + RESPONSE_LENGTHS.get(cmd_id, ACK_LENGTH)
+        return nbytes * self.bits_per_byte / self.baudrate
+
+    @staticmethod
+    def _key(cmd_bytes):
+        return (cmd_bytes[1] << 8 | cmd_bytes[2], cmd_bytes[3])
+
+    def timeout(self, cmd_bytes):
+        """Read timeout for this command to this device."""
+        key = self._key(cmd_bytes)
+        wire = self.wire_time(key[1])
+        estimate = self.estimates.get(key)
+        if estimate is None or estimate[0] is None:
+            value = wire * self.margin + self.turnaround
+        else:
+            srtt, rttvar, _ = estimate
+            value = max(srtt + max(self.slack, 4 * rttvar), wire * self.margin)
+        if estimate is not None and estimate[2]:
+            value *= 2 ** estimate[2]
+        return min(self.max_timeout, max(self.min_timeout, value))
+
+    def record_response(self, cmd_bytes, elapsed):
+        key = self._key(cmd_bytes)
+        estimate = self.estimates.get(key)
+        if estimate is None or estimate[0] is None:
+            self.estimates[key] = [elapsed, elapsed / 2, 0]
+        else:
+            srtt, rttvar, _ = estimate
+            rttvar = 0.75 * rttvar + 0.25 * abs(srtt - elapsed)
+            self.estimates[key] = [0.875 * srtt + 0.125 * elapsed, rttvar, 0]
+        self.devices.pop(key[0], None)
+
+    def record_failure(self, cmd_bytes, timed_out=True):
+        """No (valid) response. Only a silent line grows the read timeout."""
+        key = self._key(cmd_bytes)
+        if timed_out:
+            estimate = self.estimates.setdefault(key, [None, None, 0])
+            # Stop doubling once the cap is reached
+            if self.timeout(cmd_bytes) < self.max_timeout:
+                estimate[2] += 1
+        device = self.devices.setdefault(key[0], [0, 0.0])
+        device[0] += 1
+        if device[0] >= self.backoff_after:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (device[0] - self.backoff_after))
+            device[1] = time.monotonic() + delay
+
+    def check_backoff(self, cmd_bytes):
+        """Raise DeviceBackoffError while the addressed device is backed off."""
+        address = self._key(cmd_bytes)[0]
+        device = self.devices.get(address)
+        if device is not None:
+            remaining = device[1] - time.monotonic()
+            if remaining > 0:
+                raise DeviceBackoffError(
+                    f"Device {address} missed {device[0]} responses, next poll in {remaining:.1f}s")
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "baudrate": self.baudrate,
+            "estimates": [
+                {"network_address": address, "command": f"{cmd:02X}",
+                 "srtt_ms": None if srtt is None else round(srtt * 1000, 2),
+                 "rttvar_ms": None if rttvar is None else round(rttvar * 1000, 2),
+                 "timeouts_in_row": timeouts,
+                 "timeout_ms": round(self.timeout(bytes((0xFA, address >> 8, address & 0xFF, cmd))) * 1000, 2)}
+                for (address, cmd), (srtt, rttvar, timeouts) in sorted(self.estimates.items())
+            ],
+            "backoff": [
+                {"network_address": address, "failures_in_row": failures,
+                 "retry_in_seconds": round(max(0.0, retry_at - now), 3)}
+                for address, (failures, retry_at) in sorted(self.devices.items())
+            ],
+        }
@@ -0,0 +1,36 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from device_simulator import build_frame  # noqa: E402
+from protocol import C9_FRAME, FrameDecoder, decode_frame  # noqa: E402
+
+
+def c9_frame(network_address=16, dust=12.5):
+    payload = (network_address, 1000, 2000, 1065, dust, 1200)
+    return build_frame(network_address, 0xC9, C9_FRAME.size, payload, C9_FRAME)
+
+
+def test_stray_start_byte_with_plausible_length_does_not_hold_up_a_valid_frame():
+    frame = c9_frame()
+    decoder = FrameDecoder()
+    assert decoder.feed(b"\xfa\x30" + frame) == [frame]
+    assert decoder.stats["bad_length"] == 1
+    assert decode_frame(frame)["dust_concentration"] == 12.5
+
+
+def test_partial_frame_still_waits_for_the_rest():
+    frame = c9_frame()
+    decoder = FrameDecoder()
+    assert decoder.feed(frame[:20]) == []
+    assert decoder.feed(frame[20:]) == [frame]
+
+
+def test_needed_asks_for_the_header_then_the_rest_of_the_frame():
+    frame = c9_frame()
+    decoder = FrameDecoder()
+    assert decoder.needed() == 2
+    decoder.feed(frame[:2])
+    assert decoder.needed() == len(frame) - 2
+    assert decoder.feed(frame[2:]) == [frame]
+    assert decoder.needed() == 2
@@ -0,0 +1,87 @@
+import json, struct
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for format=msgpack
+    msgpack = None
+
+# /ws/sensor message formats, chosen by the client in its config message:
+#   json     {"raw": hex, "parsed": {...}} as text (default, unchanged)
+#   msgpack  same map as a binary MessagePack frame, raw as bytes
+#   binary   fixed little-endian layout below, ~20 bytes per reading
+FORMATS = ("json", "msgpack", "binary")
+
+# kind, flags, network_address, ld, pd, pcb_temperature, dust_concentration, current_loop
+# followed by the raw device frame when FLAG_RAW is set
+BINARY_READING = struct.Struct("<BBHHHfff")
+KIND_READING = 1
+KIND_ERROR = 2
+FLAG_RAW = 0x01
+
+
+def check_format(fmt):
+    """Error message for an unusable format, None when it can be served."""
+    if fmt not in FORMATS:
+        return f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}"
+    if fmt == "msgpack" and msgpack is None:
+        return "msgpack format needs the optional msgpack package"
+    return None
+
+
+def _error(message):
+    if "error" in message:
+        return message["error"]
+    parsed = message.get("parsed") or {}
+    if "error" in parsed:
+        return parsed["error"]
+    if "dust_concentration" not in parsed:
+        return "Unexpected response"
+    return None
+
+
+def encode_binary(message, include_raw=True):
+    error = _error(message)
+    if error is not None:
+        return bytes([KIND_ERROR]) + error.encode()
+    parsed = message["parsed"]
+    raw = bytes.fromhex(message["raw"]) if include_raw and message.get("raw") else b""
+    return BINARY_READING.pack(
+        KIND_READING, FLAG_RAW if raw else 0,
+        parsed["network_address"], parsed["ld"], parsed["pd"],
+        parsed["pcb_temperature"], parsed["dust_concentration"], parsed["current_loop"],
+    ) + raw
+
+
+def encode_message(message, fmt="json", include_raw=True):
+    """Encode a poller message for one client. Returns str (text frame) or bytes."""
+    if not include_raw and "raw" in message:
+        message = {key: value for key, value in message.items() if key != "raw"}
+    if fmt == "binary":
+        return encode_binary(message, include_raw)
+    if fmt == "msgpack":
+        if "raw" in message:
+            message = {**message, "raw": bytes.fromhex(message["raw"])}
+        return msgpack.packb(message)
+    return json.dumps(message, separators=(",", ":"))
+
+
+# Every subscriber of a poller gets the same message object in the same tick,
+# so remember the last encoding per (format, include_raw) and reuse it.
+_last_encoded = {}
+
+def encode_cached(message, fmt="json", include_raw=True):
+    key = (fmt, include_raw)
+    cached = _last_encoded.get(key)
+    if cached is not None and cached[0] is message:
+        return cached[1]
+    encoded = encode_message(message, fmt, include_raw)
+    _last_encoded[key] = (message, encoded)
+    return encoded
+
+
+async def send_encoded(websocket, message, fmt="json", include_raw=True):
+    data = encode_cached(message, fmt, include_raw)
+    if isinstance(data, bytes):
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)